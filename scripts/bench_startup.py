@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark do tempo de inicialização do NFSe Renamer.
+
+Mede, em processos novos, o tempo de importação dos módulos do serviço e o tempo
+total dos subcomandos leves da CLI (status, lookup, profiles), usando um
+config.env temporário. Com -X importtime, lista as importações mais caras e
+verifica que pdfplumber/pdfminer/PIL, ftplib e watchdog não são carregados
+antes do primeiro uso.
+
+Exemplos (a partir da raiz do projeto):
+    python3 scripts/bench_startup.py
+    python3 scripts/bench_startup.py --repeat 20 --top 15
+    python3 scripts/bench_startup.py --max-ms 150 --json startup.json   # falha se exceder o orçamento
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos que só devem ser importados no primeiro uso
+HEAVY_MODULES = ("pdfplumber", "pdfminer", "PIL", "ftplib", "watchdog")
+
+# Alvos medidos: nome -> argumentos do interpretador
+TARGETS = {
+    "import src.nfse_service": ["-c", "import src.nfse_service"],
+    "import src.cli": ["-c", "import src.cli"],
+    "cli status": ["-m", "src", "status"],
+    "cli lookup": ["-m", "src", "lookup", "nfse_00000000000000_0_0_x.pdf"],
+    "cli profiles": ["-m", "src", "profiles"],
+}
+
+def write_config(base):
+    config_file = os.path.join(base, "config.env")
+    values = {
+        "INPUT_DIR": os.path.join(base, "inbound"),
+        "OUTPUT_DIR": os.path.join(base, "processed"),
+        "REJECT_DIR": os.path.join(base, "reject"),
+        "STATE_DIR": os.path.join(base, "state"),
+        "LOG_FILE": os.path.join(base, "log", "nfse.log"),
+    }
+    for key in ("INPUT_DIR", "OUTPUT_DIR", "REJECT_DIR", "STATE_DIR"):
+        os.makedirs(values[key], exist_ok=True)
+    with open(config_file, "w") as f:
+        for key, value in values.items():
+            f.write(f'{key}="{value}"\n')
+    return config_file
+
+def run_once(args, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=PROJECT_DIR, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def import_profile(args, env):
+    """Executa com -X importtime; retorna [(módulo, acumulado_us)] e os módulos pesados carregados."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=PROJECT_DIR, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # Cabeçalho
+        imports.append((parts[2].strip(), int(parts[1])))
+    heavy = sorted({name.split(".")[0] for name, _ in imports if name.split(".")[0] in HEAVY_MODULES})
+    return imports, heavy
+
+def measure(name, args, env, repeat):
+    run_once(args, env)  # Aquece o cache de bytecode e do sistema de arquivos
+    samples = [run_once(args, env) for _ in range(repeat)]
+    imports, heavy = import_profile(args, env)
+    return {
+        "alvo": name,
+        "mediana_ms": statistics.median(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "modulos_pesados": heavy,
+        "mais_caras": sorted(imports, key=lambda item: item[1], reverse=True),
+    }
+
+def print_result(result, top):
+    heavy = ", ".join(result["modulos_pesados"]) or "nenhum"
+    print(f"[{result['alvo']}] mediana={result['mediana_ms']:.1f}ms "
+          f"min={result['min_ms']:.1f}ms max={result['max_ms']:.1f}ms  pesados carregados: {heavy}")
+    for module, us in result["mais_caras"][:top]:
+        print(f"    {us / 1000:8.1f}ms  {module}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do tempo de inicialização do NFSe Renamer")
+    parser.add_argument("--repeat", type=int, default=10, help="execuções medidas por alvo")
+    parser.add_argument("--top", type=int, default=10, help="importações mais caras listadas por alvo")
+    parser.add_argument("--max-ms", type=float, help="orçamento (mediana) por alvo; excedido = código de saída 1")
+    parser.add_argument("--json", help="grava os resultados em JSON")
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix="nfse-bench-")
+    try:
+        env = dict(os.environ, NFSE_CONFIG_FILE=write_config(base))
+        results = []
+        for name, target_args in TARGETS.items():
+            result = measure(name, target_args, env, args.repeat)
+            print_result(result, args.top)
+            results.append(result)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [r["alvo"] for r in results if r["modulos_pesados"]]
+    if args.max_ms is not None:
+        failed += [r["alvo"] for r in results if r["mediana_ms"] > args.max_ms]
+    if failed:
+        print(f"FALHA: {', '.join(sorted(set(failed)))}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
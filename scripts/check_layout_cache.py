@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Verificação do cache de layout por emitente.
+
+Aprende o layout de uma nota com valores curtos e compara, para notas do mesmo
+emitente com RPS, NFSe e Série de tamanhos diferentes, o nome obtido pelo cache
+(extração recortada) com o da extração completa da página. Valores mais longos
+que os do template não podem sair cortados do recorte: o cache deve recorrer à
+extração completa.
+
+Também aprende o layout de vários emitentes com o mesmo tamanho de página e
+confere que as notas de todos eles acertam o cache (não apenas as dos emitentes
+mais usados), mostrando o tempo médio da extração recortada e da completa.
+
+Exemplo (a partir da raiz do projeto):
+    python3 scripts/check_layout_cache.py      # código de saída 1 se algum nome divergir
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, "scripts"))
+
+from load_test import CNPJ, make_pdf  # noqa: E402
+from src import extract_nfse_info as extractor, layout_cache  # noqa: E402
+
+# Nota usada para aprender o layout, seguida das notas comparadas: (rps, nfse, serie)
+TEMPLATE = ("1", "1", "1")
+CASES = [
+    ("7", "2", "1"),
+    ("123456789", "1", "1"),
+    ("1", "9876543210", "1"),
+    ("1", "1", "AB-12"),
+    ("123456789", "9876543210", "AB-12"),
+    ("123456789", "42", "SERIE-LONGA_2024"),
+]
+
+# Emitentes com o mesmo tamanho de página (mais que LAYOUT_MAX_CANDIDATES) e notas por emitente
+ISSUERS = [CNPJ] + [f"{n:02d}.111.222/0001-{n:02d}" for n in range(10, 15)]
+NOTES_PER_ISSUER = 5
+
+def extract(data, cached):
+    layout_cache.ENABLED = cached
+    return extractor.extract_nfse_info(io.BytesIO(data))
+
+def check_issuers(state_dir):
+    """Retorna o número de emitentes com template que não acertaram o cache."""
+    layout_cache.load_cache(os.path.join(state_dir, "layout_cache_emitentes.json"))
+    for cnpj in ISSUERS:
+        extract(make_pdf("1", "1", cnpj=cnpj), cached=True)
+    timings = {"cache": [], "completa": []}
+    failures = 0
+    for cnpj in ISSUERS:
+        hits_before = layout_cache.LAYOUT_STATS["acertos"]
+        for number in range(NOTES_PER_ISSUER):
+            data = make_pdf(str(100 + number), str(200 + number), cnpj=cnpj)
+            for mode, cached in (("completa", False), ("cache", True)):
+                start = time.perf_counter()
+                extract(data, cached=cached)
+                timings[mode].append(time.perf_counter() - start)
+        hits = layout_cache.LAYOUT_STATS["acertos"] - hits_before
+        status = "ok" if hits == NOTES_PER_ISSUER else "SEM ACERTOS"
+        failures += hits != NOTES_PER_ISSUER
+        print(f"[{status}] emitente {cnpj}: {hits}/{NOTES_PER_ISSUER} acerto(s)")
+    for mode, values in timings.items():
+        print(f"Extração {mode}: {1000 * sum(values) / len(values):.1f} ms em média")
+    return failures
+
+def main():
+    state_dir = tempfile.mkdtemp(prefix="nfse-layout-")
+    failures = 0
+    try:
+        for number, (rps, nfse, serie) in enumerate(CASES):
+            # Cache novo a cada caso: o layout comparado é sempre o aprendido com TEMPLATE
+            layout_cache.load_cache(os.path.join(state_dir, f"layout_cache_{number}.json"))
+            extract(make_pdf(*TEMPLATE), cached=True)
+            data = make_pdf(rps, nfse, serie)
+            full = extract(data, cached=False)
+            cached = extract(data, cached=True)
+            status = "ok" if cached == full else "DIVERGENTE"
+            failures += cached != full
+            print(f"[{status}] rps={rps} nfse={nfse} serie={serie}: cache={cached} completa={full}")
+        print(f"Cache de layout: {layout_cache.format_stats()}")
+        failures += check_issuers(state_dir)
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    if failures:
+        print(f"FALHA: {failures} nome(s) divergente(s) ou emitente(s) sem acertos")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Teste de carga ponta a ponta do NFSe Renamer Service.
+
+Sobe o serviço (python3 -m src) contra diretórios temporários INPUT/OUTPUT/REJECT
+e um servidor FTP local em processo, com latência e falhas injetáveis. Deposita
+PDFs sintéticos em uma taxa configurável e mede o atraso entre a chegada do
+arquivo e a entrega no destino, além da vazão sob saturação.
+
+Exemplos (a partir da raiz do projeto):
+    python3 scripts/load_test.py                          # watchdog, destino local
+    python3 scripts/load_test.py --monitor polling --dest ftp --ftp-latency 0.2
+    python3 scripts/load_test.py --rate 0 --count 500     # saturação (tudo de uma vez)
+    python3 scripts/load_test.py --matrix --json resultado.json
+"""
+import argparse
+import json
+import os
+import posixpath
+import random
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Destinos cobertos: combinações RENAME_IN_PLACE / USE_FTP de process_pdf
+DESTINATIONS = {
+    "local": {"RENAME_IN_PLACE": "false", "USE_FTP": "false"},
+    "inplace": {"RENAME_IN_PLACE": "true", "USE_FTP": "false"},
+    "ftp": {"RENAME_IN_PLACE": "false", "USE_FTP": "true"},
+    "inplace-ftp": {"RENAME_IN_PLACE": "true", "USE_FTP": "true"},
+}
+MONITORS = ("watchdog", "polling")
+
+CNPJ = "02.886.427/0024-50"
+FTP_PATH = "/nfse"
+
+def make_pdf(rps, nfse, serie="1", cnpj=CNPJ):
+    """Gera um PDF mínimo, com camada de texto, no layout esperado pelo extrator."""
+    lines = [
+        "PREFEITURA MUNICIPAL - NOTA FISCAL DE SERVICOS ELETRONICA",
+        f"N\\372mero da Nota {nfse}",
+        f"Prestador CNPJ {cnpj}",
+        f"RPS N\\272 {rps}   S\\351rie {serie}",
+        "Tomador CNPJ 11.222.333/0001-81",
+        "Discriminacao dos servicos prestados conforme contrato vigente",
+    ]
+    content = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [5 0 R] /Count 1 >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents 4 0 R >>",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+class FtpStandIn:
+    """
+    Servidor FTP mínimo em processo (USER/PASS/CWD/MKD/PASV/EPSV/STOR/QUIT),
+    suficiente para o ftplib do serviço. Registra o horário de entrega de cada arquivo.
+    """
+
+    def __init__(self, root, latency=0.0, fail_rate=0.0):
+        self.root = root
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.landed = {}  # nome -> horário de entrega
+        self.failures = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write((line + "\r\n").encode())
+                self.wfile.flush()
+
+            def handle(self):
+                cwd = "/"
+                data_listener = None
+                self.reply("220 FTP local de teste")
+                while True:
+                    raw = self.rfile.readline()
+                    if not raw:
+                        break
+                    command, _, arg = raw.decode("utf-8", "replace").strip().partition(" ")
+                    command = command.upper()
+                    target = posixpath.normpath(posixpath.join(cwd, arg)) if arg else cwd
+                    local = os.path.join(stand_in.root, target.lstrip("/"))
+                    if command == "USER":
+                        self.reply("331 Senha requerida")
+                    elif command == "PASS":
+                        self.reply("230 Login efetuado")
+                    elif command in ("TYPE", "MODE", "STRU"):
+                        self.reply("200 OK")
+                    elif command == "SYST":
+                        self.reply("215 UNIX Type: L8")
+                    elif command == "NOOP":
+                        self.reply("200 OK")
+                    elif command == "PWD":
+                        self.reply(f'257 "{cwd}"')
+                    elif command == "CWD":
+                        if os.path.isdir(local):
+                            cwd = target
+                            self.reply("250 OK")
+                        else:
+                            self.reply("550 Diretório inexistente")
+                    elif command == "MKD":
+                        os.makedirs(local, exist_ok=True)
+                        self.reply(f'257 "{target}" criado')
+                    elif command in ("PASV", "EPSV"):
+                        if data_listener:
+                            data_listener.close()
+                        data_listener = socket.socket()
+                        data_listener.bind(("127.0.0.1", 0))
+                        data_listener.listen(1)
+                        port = data_listener.getsockname()[1]
+                        if command == "PASV":
+                            self.reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xFF})")
+                        else:
+                            self.reply(f"229 Entering Extended Passive Mode (|||{port}|)")
+                    elif command == "STOR":
+                        if not data_listener:
+                            self.reply("425 Use PASV primeiro")
+                            continue
+                        self.reply("150 Enviando")
+                        conn, _ = data_listener.accept()
+                        data_listener.close()
+                        data_listener = None
+                        part = local + ".part"
+                        with conn, open(part, "wb") as f:
+                            while True:
+                                chunk = conn.recv(65536)
+                                if not chunk:
+                                    break
+                                f.write(chunk)
+                        if stand_in.latency:
+                            time.sleep(stand_in.latency)
+                        if random.random() < stand_in.fail_rate:
+                            os.remove(part)
+                            with stand_in.lock:
+                                stand_in.failures += 1
+                            self.reply("451 Falha injetada")
+                            continue
+                        os.replace(part, local)
+                        with stand_in.lock:
+                            stand_in.landed[os.path.basename(local)] = time.time()
+                        self.reply("226 Transferência concluída")
+                    elif command == "QUIT":
+                        self.reply("221 Tchau")
+                        break
+                    else:
+                        self.reply("502 Comando não implementado")
+                if data_listener:
+                    data_listener.close()
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def write_config(path, dirs, monitor, dest, ftp_port, extra):
+    config = {
+        "INPUT_DIR": dirs["input"],
+        "OUTPUT_DIR": dirs["output"],
+        "REJECT_DIR": dirs["reject"],
+        "LOG_FILE": os.path.join(dirs["base"], "logs", "nfse_renamer.log"),
+        "STATE_DIR": os.path.join(dirs["base"], "state"),
+        "USE_POLLING": "true" if monitor == "polling" else "false",
+        "POLLING_INTERVAL": "1",
+        "RETRY_DELAY": "1",
+        "FIX_PERMISSIONS_ON_CYCLE": "false",
+        "FTP_HOST": "127.0.0.1",
+        "FTP_PORT": str(ftp_port),
+        "FTP_PATH": FTP_PATH,
+        "FTP_TIMEOUT": "10",
+    }
+    config.update(DESTINATIONS[dest])
+    config.update(extra)
+    with open(path, "w") as f:
+        for key, value in config.items():
+            f.write(f'{key}="{value}"\n')
+    return config
+
+def wait_for_log(log_file, markers, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(log_file):
+            with open(log_file, encoding="utf-8", errors="replace") as f:
+                content = f.read()
+            if any(marker in content for marker in markers):
+                return True
+        time.sleep(0.1)
+    return False
+
+def run_scenario(monitor, dest, args):
+    """Executa um cenário e retorna as métricas."""
+    base = tempfile.mkdtemp(prefix=f"nfse-load-{monitor}-{dest}-")
+    dirs = {name: os.path.join(base, name) for name in ("input", "output", "reject", "ftp")}
+    dirs["base"] = base
+    for key in ("input", "output", "reject", "ftp"):
+        os.makedirs(dirs[key])
+
+    ftp = FtpStandIn(dirs["ftp"], latency=args.ftp_latency, fail_rate=args.ftp_fail_rate)
+    ftp.start()
+
+    extra = dict(item.split("=", 1) for item in args.set)
+    config_file = os.path.join(base, "config.env")
+    config = write_config(config_file, dirs, monitor, dest, ftp.port, extra)
+
+    env = dict(os.environ, NFSE_CONFIG_FILE=config_file)
+    service = subprocess.Popen(
+        [sys.executable, "-m", "src"], cwd=PROJECT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+    )
+    try:
+        if not wait_for_log(config["LOG_FILE"], ("Modo WATCHDOG ativado", "Modo POLLING ativado"), 30):
+            raise RuntimeError(f"Serviço não iniciou (ver {config['LOG_FILE']})")
+
+        # Pré-gera os PDFs: o custo de geração não entra na medição
+        documents = {}
+        for i in range(args.count):
+            rps, nfse = str(100000 + i), str(i + 1)
+            expected = f"nfse_{CNPJ.replace('.', '').replace('/', '').replace('-', '')}_{rps}_{nfse}_1.pdf"
+            documents[f"NFSE_{i:06d}.pdf"] = (expected, make_pdf(rps, nfse))
+
+        # Onde cada arquivo é considerado entregue
+        local_dirs = []
+        if dest in ("local", "ftp"):
+            local_dirs.append(("output", dirs["output"]))  # em "ftp", OUTPUT_DIR é o fallback
+        if dest in ("inplace",):
+            local_dirs.append(("inplace", dirs["input"]))
+        arrivals = {}
+        landed = {}  # nome esperado -> (horário, local)
+        rejected = set()
+        by_expected = {expected: name for name, (expected, _) in documents.items()}
+
+        stop = threading.Event()
+
+        def watch():
+            while not stop.is_set():
+                now = time.time()
+                for label, directory in local_dirs:
+                    for entry in os.scandir(directory):
+                        if entry.name in by_expected and entry.name not in landed:
+                            landed[entry.name] = (now, label)
+                for name in list(ftp.landed):
+                    if name in by_expected and name not in landed:
+                        landed[name] = (ftp.landed[name], "ftp")
+                for entry in os.scandir(dirs["reject"]):
+                    rejected.add(entry.name)
+                time.sleep(0.005)
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+
+        interval = 1.0 / args.rate if args.rate > 0 else 0.0
+        start = time.time()
+        for i, (name, (_, data)) in enumerate(documents.items()):
+            if interval:
+                delay = start + i * interval - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            with open(os.path.join(dirs["input"], name), "wb") as f:
+                f.write(data)
+            arrivals[documents[name][0]] = time.time()
+        last_drop = time.time()
+
+        deadline = last_drop + args.timeout
+        while time.time() < deadline and len(landed) + len(rejected) < args.count:
+            time.sleep(0.05)
+        stop.set()
+        watcher.join()
+
+        # inplace-ftp: falha no upload deixa o arquivo apenas renomeado localmente
+        if dest == "inplace-ftp":
+            for entry in os.scandir(dirs["input"]):
+                if entry.name in by_expected and entry.name not in landed:
+                    landed[entry.name] = (None, "inplace-sem-ftp")
+    finally:
+        service.send_signal(signal.SIGTERM)
+        try:
+            service.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            service.kill()
+        ftp.stop()
+
+    latencies = [landed[name][0] - arrivals[name] for name in landed if landed[name][0] is not None]
+    first_arrival = min(arrivals.values())
+    last_landing = max((when for when, _ in landed.values() if when is not None), default=first_arrival)
+    locations = {}
+    for _, location in landed.values():
+        locations[location] = locations.get(location, 0) + 1
+
+    result = {
+        "monitor": monitor,
+        "destino": dest,
+        "enviados": args.count,
+        "entregues": len(landed),
+        "rejeitados": len(rejected),
+        "perdidos": args.count - len(landed) - len(rejected),
+        "locais": locations,
+        "falhas_ftp_injetadas": ftp.failures,
+        "latencia_p50": percentile(latencies, 50),
+        "latencia_p90": percentile(latencies, 90),
+        "latencia_p99": percentile(latencies, 99),
+        "latencia_max": max(latencies) if latencies else None,
+        "vazao_arquivos_s": len(landed) / (last_landing - first_arrival) if last_landing > first_arrival else None,
+        "taxa_envio": args.rate,
+        "diretorio": base,
+    }
+    if not args.keep:
+        shutil.rmtree(base, ignore_errors=True)
+    return result
+
+def print_result(result):
+    def fmt(value, suffix="s"):
+        return f"{value:.3f}{suffix}" if value is not None else "-"
+
+    print(f"[{result['monitor']}/{result['destino']}] "
+          f"enviados={result['enviados']} entregues={result['entregues']} "
+          f"rejeitados={result['rejeitados']} perdidos={result['perdidos']} "
+          f"locais={result['locais']} falhas_ftp={result['falhas_ftp_injetadas']}")
+    print(f"    latência p50={fmt(result['latencia_p50'])} p90={fmt(result['latencia_p90'])} "
+          f"p99={fmt(result['latencia_p99'])} max={fmt(result['latencia_max'])} "
+          f"vazão={fmt(result['vazao_arquivos_s'], ' arq/s')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga ponta a ponta do NFSe Renamer")
+    parser.add_argument("--monitor", choices=MONITORS, default="watchdog")
+    parser.add_argument("--dest", choices=sorted(DESTINATIONS), default="local")
+    parser.add_argument("--matrix", action="store_true", help="executa todas as combinações monitor x destino")
+    parser.add_argument("--count", type=int, default=200, help="quantidade de PDFs depositados")
+    parser.add_argument("--rate", type=float, default=20.0, help="PDFs por segundo (0 = todos de uma vez, saturação)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="espera máxima após o último depósito (s)")
+    parser.add_argument("--ftp-latency", type=float, default=0.0, help="latência adicionada a cada STOR (s)")
+    parser.add_argument("--ftp-fail-rate", type=float, default=0.0, help="fração de STOR que falham (451)")
+    parser.add_argument("--set", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="sobrescreve uma chave do config.env do serviço (pode repetir)")
+    parser.add_argument("--json", help="grava os resultados em JSON")
+    parser.add_argument("--keep", action="store_true", help="mantém os diretórios temporários")
+    args = parser.parse_args()
+
+    scenarios = [(m, d) for m in MONITORS for d in DESTINATIONS] if args.matrix else [(args.monitor, args.dest)]
+    results = []
+    for monitor, dest in scenarios:
+        result = run_scenario(monitor, dest, args)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 """
 Ponto de entrada para executar o NFSe Renamer Service como módulo Python.
-Permite executar com: python3 -m src
+Permite executar com: python3 -m src [subcomando]
 """
-from .nfse_service import main
+from .cli import main
 
 if __name__ == "__main__":
     main()
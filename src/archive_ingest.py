@@ -0,0 +1,85 @@
+"""
+Leitura de pacotes ZIP/TAR com NFSe, sem extração para arquivos temporários.
+
+Os membros PDF são lidos diretamente do pacote para a memória, um por vez,
+para serem processados pelo serviço.
+"""
+import os
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+class ArchiveError(ValueError):
+    """Pacote ilegível ou com formato não suportado."""
+    pass
+
+def is_archive(filename):
+    """Verifica se o nome corresponde a um pacote suportado."""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def _read_limited(stream, max_size):
+    """Lê no máximo max_size bytes; retorna None se o membro exceder o limite."""
+    data = stream.read(max_size + 1)
+    return None if len(data) > max_size else data
+
+def iter_pdf_members(archive_path, max_member_size):
+    """
+    Percorre os membros do pacote.
+    Gera tuplas (nome_membro, dados, motivo): dados é None quando o membro é ignorado
+    ou rejeitado antes da leitura, e motivo descreve a causa.
+    Lança ArchiveError se o pacote não puder ser aberto.
+    """
+    # zipfile/tarfile só são importados quando um pacote é de fato aberto
+    if archive_path.lower().endswith(".zip"):
+        import zipfile
+        try:
+            archive = zipfile.ZipFile(archive_path)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise ArchiveError(f"ZIP ilegível: {e}")
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if not info.filename.lower().endswith(".pdf"):
+                    yield info.filename, None, "ignorado (não é PDF)"
+                    continue
+                if info.file_size > max_member_size:
+                    yield info.filename, None, f"membro excede o limite de {max_member_size} bytes"
+                    continue
+                try:
+                    with archive.open(info) as stream:
+                        data = _read_limited(stream, max_member_size)
+                except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                    yield info.filename, None, f"erro ao ler membro: {type(e).__name__}: {e}"
+                    continue
+                if data is None:
+                    yield info.filename, None, f"membro excede o limite de {max_member_size} bytes"
+                    continue
+                yield info.filename, data, None
+        return
+
+    import tarfile
+    try:
+        archive = tarfile.open(archive_path, "r:*")
+    except (tarfile.TarError, OSError) as e:
+        raise ArchiveError(f"TAR ilegível: {e}")
+    with archive:
+        try:
+            # Iteração sequencial: permite ler TAR comprimido em streaming
+            for member in archive:
+                if not member.isfile():
+                    continue
+                if not member.name.lower().endswith(".pdf"):
+                    yield member.name, None, "ignorado (não é PDF)"
+                    continue
+                if member.size > max_member_size:
+                    yield member.name, None, f"membro excede o limite de {max_member_size} bytes"
+                    continue
+                stream = archive.extractfile(member)
+                data = _read_limited(stream, max_member_size) if stream else None
+                if data is None:
+                    yield member.name, None, "membro ilegível ou excede o limite de tamanho"
+                    continue
+                yield member.name, data, None
+        except (tarfile.TarError, OSError, EOFError) as e:
+            # Pacote truncado: membros já lidos continuam válidos
+            yield os.path.basename(archive_path), None, f"pacote truncado ou corrompido: {e}"
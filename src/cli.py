@@ -0,0 +1,174 @@
+"""
+Linha de comando do NFSe Renamer.
+
+Sem subcomando, executa o serviço. Subcomandos utilitários (não importam
+pdfplumber, ftplib nem watchdog, exceto quando reprocessam PDFs):
+    python3 -m src status     # resumo do estado (entrada, rejeitados, journal, pacotes)
+    python3 -m src profiles   # resumo dos perfis guardados (PROFILE_MODE)
+    python3 -m src reprocess  # reprocessa em lote os PDFs de REJECT_DIR
+    python3 -m src pack       # empacota os arquivos antigos de cada OUTPUT_DIR (PACK_AFTER_DAYS)
+    python3 -m src lookup     # localiza (e extrai) um arquivo processado, solto ou empacotado
+"""
+import argparse
+import sys
+
+def cmd_run(args):
+    from .nfse_service import main as run_service
+    run_service()
+
+def cmd_status(args):
+    import os
+    from . import journal, nfse_service
+    try:
+        nfse_service.read_config()
+    except Exception as e:
+        print(f"ERRO: Falha ao carregar configuração: {e}")
+        sys.exit(1)
+    config = nfse_service.CONFIG
+
+    def _count(directory, predicate):
+        try:
+            with os.scandir(directory) as entries:
+                return sum(1 for entry in entries if entry.is_file() and predicate(entry.name))
+        except OSError:
+            return None
+
+    for source_cfg in nfse_service.SOURCES:
+        pending = _count(source_cfg["INPUT_DIR"], nfse_service.should_process_file)
+        label = "INPUT_DIR" if len(nfse_service.SOURCES) == 1 else nfse_service.source_name(source_cfg)
+        print(f"Aguardando em {label}:".ljust(26) + f"{pending if pending is not None else 'pasta inacessível'}")
+    rejected = _count(config["REJECT_DIR"], lambda name: name.lower().endswith(".pdf"))
+    print(f"Rejeitados em REJECT_DIR: {rejected if rejected is not None else 'pasta inacessível'}")
+    if config["JOURNAL_ENABLED"].lower() in ("true", "1", "yes"):
+        in_flight = journal.read_pending(os.path.join(config["STATE_DIR"], "journal.jsonl"))
+        print(f"Journal: {len(in_flight)} arquivo(s) em processamento ou interrompido(s)")
+        for path, entry in sorted(in_flight.items()):
+            print(f"  {entry['estado']:<12} {path}")
+    if config["PACK_ENABLED"].lower() in ("true", "1", "yes"):
+        packs = sum(_count(pack_dir, lambda name: name.endswith(".zip")) or 0
+                    for _, pack_dir in nfse_service.pack_targets())
+        print(f"Pacotes em PACK_DIR: {packs}")
+
+def cmd_profiles(args):
+    from . import nfse_service, profiling
+    try:
+        nfse_service.read_config()
+    except Exception as e:
+        print(f"ERRO: Falha ao carregar configuração: {e}")
+        sys.exit(1)
+    profile_dir = args.dir or nfse_service.CONFIG["PROFILE_DIR"]
+    profiling.print_summary(profile_dir, top=args.top, functions=args.functions)
+
+def cmd_reprocess(args):
+    from . import journal, nfse_service, workers
+    try:
+        nfse_service.load_config()
+    except Exception as e:
+        print(f"ERRO: Falha ao carregar configuração: {e}")
+        sys.exit(1)
+    # O serviço acrescenta registros ao índice de deduplicação e ao registro de rejeitados,
+    # que init_state reescreve: os dois não podem usar STATE_DIR ao mesmo tempo
+    if not nfse_service.lock_state_dir(wait=False):
+        print("ERRO: o serviço está em execução e usa o mesmo STATE_DIR; pare-o antes de reprocessar "
+              "(systemctl stop nfse-renamer)")
+        sys.exit(1)
+    if args.workers:
+        nfse_service.CONFIG["MAX_WORKERS"] = str(args.workers)
+    nfse_service.setup_logging()
+    nfse_service.init_state()
+    try:
+        summary = nfse_service.reprocess_reject_dir(force=args.force, dry_run=args.dry_run)
+    finally:
+        workers.shutdown_pool()
+        journal.close_journal()
+    print(f"Analisados: {summary['analisados']}  Recuperados: {summary['recuperados']}  "
+          f"Ainda rejeitados: {summary['rejeitados']}  Ignorados (sem mudança): {summary['ignorados']}")
+
+def cmd_pack(args):
+    from . import nfse_service, output_packer
+    try:
+        nfse_service.read_config()
+    except Exception as e:
+        print(f"ERRO: Falha ao carregar configuração: {e}")
+        sys.exit(1)
+    nfse_service.setup_logging()
+    days = args.days if args.days is not None else int(nfse_service.CONFIG["PACK_AFTER_DAYS"])
+    batch_size = args.batch_size or int(nfse_service.CONFIG["PACK_BATCH_SIZE"])
+    total = {"arquivos": 0, "pacotes": 0, "bytes": 0}
+    for output_dir, pack_dir in nfse_service.pack_targets():
+        while True:
+            summary = output_packer.pack_once(output_dir, pack_dir, days, batch_size)
+            for key, value in summary.items():
+                total[key] += value
+            if not args.all or not summary["arquivos"]:
+                break
+    print(f"Empacotados: {total['arquivos']} arquivo(s) em {total['pacotes']} pacote(s), "
+          f"{total['bytes'] / (1024 * 1024):.1f} MB")
+
+def cmd_lookup(args):
+    import os
+    from . import nfse_service, output_packer
+    try:
+        nfse_service.read_config()
+    except Exception as e:
+        print(f"ERRO: Falha ao carregar configuração: {e}")
+        sys.exit(1)
+    targets = nfse_service.pack_targets()
+    for output_dir, _ in targets:
+        loose_path = os.path.join(output_dir, args.nome)
+        if os.path.exists(loose_path):
+            print(f"{args.nome}: {loose_path} (não empacotado)")
+            return
+    matches = [(pack_dir, entry) for _, pack_dir in targets for entry in output_packer.lookup(pack_dir, args.nome)]
+    if not matches:
+        pack_dirs = ", ".join(pack_dir for _, pack_dir in targets) or "PACK_DIR"
+        print(f"{args.nome}: não encontrado em OUTPUT_DIR nem no índice de {pack_dirs}")
+        sys.exit(1)
+    for pack_dir, entry in matches:
+        print(f"{args.nome}: {os.path.join(pack_dir, entry['pacote'])} ({entry['tamanho']} bytes)")
+    if args.extract:
+        # Nomes repetidos (empacotados antes da verificação em reserve_destination): extrai a ocorrência mais recente
+        pack_dir, entry = matches[-1]
+        print(f"Extraído: {output_packer.extract(pack_dir, entry, args.extract)}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python3 -m src", description="NFSe Renamer Service")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="executa o serviço (padrão)")
+    run_parser.set_defaults(func=cmd_run)
+
+    status_parser = subparsers.add_parser("status", help="resumo do estado do serviço")
+    status_parser.set_defaults(func=cmd_status)
+
+    profiles_parser = subparsers.add_parser("profiles", help="resumo dos arquivos mais lentos/pesados perfilados")
+    profiles_parser.add_argument("--dir", help="diretório de perfis (padrão: PROFILE_DIR)")
+    profiles_parser.add_argument("--top", type=int, default=10, help="arquivos listados por ranking")
+    profiles_parser.add_argument("--functions", type=int, default=15, help="funções listadas por perfil")
+    profiles_parser.set_defaults(func=cmd_profiles)
+
+    reprocess_parser = subparsers.add_parser("reprocess", help="reprocessa em lote os PDFs de REJECT_DIR")
+    reprocess_parser.add_argument("--force", action="store_true",
+                                  help="inclui arquivos rejeitados pela versão atual do extrator")
+    reprocess_parser.add_argument("--dry-run", action="store_true", help="apenas lista o que seria reprocessado")
+    reprocess_parser.add_argument("--workers", type=int, help="workers em paralelo (padrão: MAX_WORKERS)")
+    reprocess_parser.set_defaults(func=cmd_reprocess)
+
+    pack_parser = subparsers.add_parser("pack", help="empacota os arquivos antigos de cada OUTPUT_DIR")
+    pack_parser.add_argument("--days", type=int, help="idade mínima em dias (padrão: PACK_AFTER_DAYS)")
+    pack_parser.add_argument("--batch-size", type=int, help="arquivos por rodada (padrão: PACK_BATCH_SIZE)")
+    pack_parser.add_argument("--all", action="store_true", help="repete as rodadas até não restar arquivo elegível")
+    pack_parser.set_defaults(func=cmd_pack)
+
+    lookup_parser = subparsers.add_parser("lookup", help="localiza um arquivo processado pelo nome")
+    lookup_parser.add_argument("nome", help="nome do arquivo (ex: nfse_12345678000199_10_123_a1.pdf)")
+    lookup_parser.add_argument("--extract", metavar="DIR", help="extrai o arquivo do pacote para DIR")
+    lookup_parser.set_defaults(func=cmd_lookup)
+
+    return parser
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando"""
+    args = build_parser().parse_args(argv)
+    func = getattr(args, "func", cmd_run)
+    func(args)
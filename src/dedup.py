@@ -0,0 +1,132 @@
+"""
+Deduplicação de NFSe reenviadas pelos ERPs.
+
+Mantém dois índices em memória, persistidos em um arquivo JSON Lines:
+- hash SHA-256 do conteúdo -> nome, campos e destino do arquivo armazenado
+- chave da nota (CNPJ, RPS, NFSe, Série) -> hash do conteúdo
+
+A chave é o nome padrão nfse_<cnpj>_<rps>_<nfse>_<serie>, independente do NAME_RULE
+da fonte, acrescido da extensão para XMLs (o XML de uma nota não é duplicata do seu
+PDF); entradas gravadas antes da chave existir usam o próprio nome.
+
+O hash é calculado em blocos, sem carregar o PDF inteiro na memória, e permite
+detectar o reenvio antes de qualquer parsing.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 MiB por leitura
+
+DEDUP_POLICIES = ("off", "skip", "link", "version")
+
+# Contadores de duplicatas detectadas (por tipo de verificação) e suprimidas
+DEDUP_STATS = {"conteudo": 0, "chave": 0, "suprimidas": 0}
+
+_LOCK = threading.Lock()
+_HASH_INDEX = {}  # sha256 -> {"nome": ..., "chave": ..., "campos": ..., "ext": ..., "destino": ..., "ts": ...}
+_KEY_INDEX = {}  # chave da nota -> sha256
+_INDEX_FILE = None
+
+def hash_file(path):
+    """Calcula o SHA-256 do arquivo lendo em blocos (streaming)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _entry_key(entry):
+    return entry.get("chave", entry["nome"])
+
+def load_index(index_file, retention_days=90):
+    """
+    Carrega o índice persistido, descartando entradas mais antigas que
+    retention_days, e reescreve o arquivo compactado.
+    """
+    global _INDEX_FILE
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    min_ts = time.time() - retention_days * 86400 if retention_days > 0 else 0
+
+    with _LOCK:
+        _INDEX_FILE = index_file
+        _HASH_INDEX.clear()
+        _KEY_INDEX.clear()
+
+        if os.path.exists(index_file):
+            with open(index_file, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Linha truncada por encerramento abrupto
+                    if entry.get("ts", 0) < min_ts:
+                        continue
+                    _HASH_INDEX.setdefault(entry["sha256"], entry)
+                    _KEY_INDEX.setdefault(_entry_key(entry), entry["sha256"])
+
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for entry in _HASH_INDEX.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_file, index_file)
+
+    logging.info(f"Índice de deduplicação carregado: {len(_HASH_INDEX)} entrada(s) de {index_file}")
+
+def entry_ext(entry):
+    """Extensão do documento registrado (entradas antigas: a do destino, ou .pdf)."""
+    if entry.get("ext"):
+        return entry["ext"]
+    return ".xml" if (entry.get("destino") or "").lower().endswith(".xml") else ".pdf"
+
+def lookup_hash(digest):
+    """Retorna a entrada armazenada para o hash de conteúdo, ou None."""
+    with _LOCK:
+        return _HASH_INDEX.get(digest)
+
+def lookup_key(key):
+    """Retorna a entrada armazenada para a chave da nota (CNPJ, RPS, NFSe, Série), ou None."""
+    with _LOCK:
+        digest = _KEY_INDEX.get(key)
+        return _HASH_INDEX.get(digest) if digest else None
+
+def register(digest, new_name, destino, key=None, fields=None, ext=None):
+    """
+    Registra um arquivo armazenado/enviado no índice (primeira ocorrência prevalece).
+    key é a chave da nota e fields os campos extraídos (padrão: o próprio nome);
+    ext é a extensão do documento (.pdf ou .xml).
+    """
+    entry = {"sha256": digest, "nome": new_name, "destino": destino, "ts": time.time()}
+    if key:
+        entry["chave"] = key
+    if fields:
+        entry["campos"] = fields
+    if ext:
+        entry["ext"] = ext
+    with _LOCK:
+        if digest in _HASH_INDEX:
+            return
+        _HASH_INDEX[digest] = entry
+        _KEY_INDEX.setdefault(_entry_key(entry), digest)
+        if _INDEX_FILE:
+            try:
+                with open(_INDEX_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                logging.warning(f"Erro ao persistir índice de deduplicação: {e}")
+
+def count_duplicate(tipo, suppressed):
+    """Incrementa os contadores de duplicatas."""
+    with _LOCK:
+        DEDUP_STATS[tipo] += 1
+        if suppressed:
+            DEDUP_STATS["suprimidas"] += 1
+
+def format_stats():
+    """Resumo dos contadores para log."""
+    with _LOCK:
+        return (f"{DEDUP_STATS['suprimidas']} suprimida(s) "
+                f"(por conteúdo: {DEDUP_STATS['conteudo']}, por chave: {DEDUP_STATS['chave']})")
@@ -1,5 +1,10 @@
+import os
 import re
-import pdfplumber
+import hashlib
+import xml.etree.ElementTree as ET
+from . import layout_cache
+
+# pdfplumber (e, por ele, pdfminer e PIL) é importado na primeira extração de PDF
 
 # PdfminerException não está disponível diretamente no pdfplumber
 # Criamos uma classe dummy para verificação de tipo de erro
@@ -10,62 +15,304 @@ class PdfminerException(Exception):
 REGEX_CNPJ = r"\b\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\b"
 REGEX_NFSE = r"(?i)Número da Nota\s*[\r\n ]*([0-9]{1,10})"
 REGEX_RPS = r"RPS Nº\s*([0-9]+)"
-REGEX_SERIE = r"(?i)Série\s*([A-Za-z0-9\-_]+)"
+SERIE_CHARSET = r"[A-Za-z0-9\-_]+"  # Caracteres aceitos na série (usada no nome do arquivo)
+REGEX_SERIE = r"(?i)Série\s*(" + SERIE_CHARSET + ")"
 
-def extract_nfse_info(pdf_path):
-    """
-    Extrai informações de NFSe do PDF.
-    Trata erros específicos do pdfplumber.
-    """
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            full_text = "\n".join([p.extract_text() or "" for p in pdf.pages])
-    except PdfminerException as e:
+# Campos usados no nome do arquivo, na ordem de validação
+FIELD_REGEXES = (("cnpj", REGEX_CNPJ), ("nfse", REGEX_NFSE), ("rps", REGEX_RPS), ("serie", REGEX_SERIE))
+
+# Incrementar ao corrigir a lógica de extração. Junto com as regex, compõe
+# EXTRACTOR_VERSION, usada para decidir quais rejeitados vale reprocessar.
+EXTRACTOR_REVISION = 1
+EXTRACTOR_VERSION = hashlib.sha1(
+    "|".join([str(EXTRACTOR_REVISION)] + [regex for _, regex in FIELD_REGEXES]).encode("utf-8")
+).hexdigest()[:12]
+
+# Margens (em pontos) aplicadas às regiões do cache de layout.
+# À direita a margem é maior, pois os números variam de tamanho entre notas.
+LAYOUT_PADDING = 4
+LAYOUT_PADDING_RIGHT = 60
+LAYOUT_MAX_PAGES = 2  # Só aprende layouts com os campos nas primeiras páginas
+LAYOUT_EDGE_MARGIN = 3  # Match que termina a menos disso da borda direita/inferior pode estar cortado
+
+def _translate_pdf_error(e):
+    """Converte erros do pdfplumber/pdfminer nas exceções tratadas pelo serviço."""
+    if isinstance(e, PdfminerException):
         # Propaga PdfminerException diretamente para melhor tratamento no código chamador
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        error_type = type(e).__name__
-        
-        # Trata erros específicos do pdfplumber/pdfminer
-        if "No /Root object" in error_msg or "/Root" in error_msg or "Root" in error_msg:
-            raise ValueError(f"PDF não pode ser lido pelo pdfplumber (estrutura não padrão): {error_msg}. O PDF pode estar corrompido ou ter formato não suportado.")
-        elif "PdfminerException" in error_type or "pdfminer" in error_msg.lower():
-            # Se for PdfminerException mas não foi capturado acima, propaga como PdfminerException
-            raise PdfminerException(error_msg)
-        else:
-            raise ValueError(f"Erro ao abrir PDF: {error_type}: {error_msg}")
+        return e
+    error_msg = str(e)
+    error_type = type(e).__name__
 
-    
+    # Trata erros específicos do pdfplumber/pdfminer
+    if "No /Root object" in error_msg or "/Root" in error_msg or "Root" in error_msg:
+        return ValueError(f"PDF não pode ser lido pelo pdfplumber (estrutura não padrão): {error_msg}. O PDF pode estar corrompido ou ter formato não suportado.")
+    elif "PdfminerException" in error_type or "pdfminer" in error_msg.lower():
+        # Se for PdfminerException mas não foi capturado acima, propaga como PdfminerException
+        return PdfminerException(error_msg)
+    else:
+        return ValueError(f"Erro ao abrir PDF: {error_type}: {error_msg}")
+
+def _normalize_fields(matches):
+    """Converte os matches das regex nos valores usados no nome do arquivo."""
+    return {
+        "cnpj": re.sub(r"\D", "", matches["cnpj"].group(0)),
+        "nfse": str(int(matches["nfse"].group(1))),
+        "rps": matches["rps"].group(1),
+        "serie": matches["serie"].group(1),
+    }
+
+def _parse_fields(full_text):
+    """Extrai os campos do texto completo do PDF."""
     # Verifica se conseguiu extrair texto
     if not full_text or len(full_text.strip()) < 50:
         raise ValueError("PDF não contém texto legível ou está vazio (texto extraído muito curto)")
-    
-    cnpj = re.search(REGEX_CNPJ, full_text)
-    if not cnpj:
-        raise ValueError("CNPJ não encontrado no PDF.")
-    cnpj = re.sub(r"\D", "", cnpj.group(0))
-
-    nfse = re.search(REGEX_NFSE, full_text)
-    if not nfse:
-        raise ValueError("Número da NFSe não encontrado no PDF.")
-    nfse_num = str(int(nfse.group(1)))
-
-    rps = re.search(REGEX_RPS, full_text)
-    if not rps:
-        raise ValueError("Número RPS não encontrado no PDF.")
-    rps_num = rps.group(1)
-
-    serie = re.search(REGEX_SERIE, full_text)
-    if not serie:
-        raise ValueError("Série não encontrada no PDF.")
-    serie_num = serie.group(1)
 
+    errors = {
+        "cnpj": "CNPJ não encontrado no PDF.",
+        "nfse": "Número da NFSe não encontrado no PDF.",
+        "rps": "Número RPS não encontrado no PDF.",
+        "serie": "Série não encontrada no PDF.",
+    }
+    matches = {}
+    for field, regex in FIELD_REGEXES:
+        matches[field] = re.search(regex, full_text)
+        if not matches[field]:
+            raise ValueError(errors[field])
+    return _normalize_fields(matches)
+
+def build_name(fields, rule=None):
+    """Monta o nome do arquivo a partir dos campos de extract_nfse_fields (rule: NAME_RULE da fonte)."""
+    return _build_name(rule=rule, **fields)
+
+def _build_name(cnpj, rps, nfse, serie, rule=None):
+    """
+    Monta o nome padronizado nfse_<cnpj>_<rps>_<nfse>_<serie>, ou o nome definido
+    por rule (ex: "{cnpj}_{nfse}"), com os campos {cnpj}, {rps}, {nfse} e {serie}.
+    """
+    if rule:
+        # Mesma regra de caixa da série do nome padrão
+        serie = serie.upper() if cnpj == "02886427001306" else serie.lower()
+        return rule.format(cnpj=cnpj, rps=rps, nfse=nfse, serie=serie)
+    
     # Regra especial: quando CNPJ for 02886427001306, série deve ser maiúscula
     if cnpj == "02886427001306":
-        serie_num = serie_num.upper()
-        return f"nfse_{cnpj}_{rps_num}_{nfse_num}_{serie_num}".lower().rsplit('_', 1)[0] + '_' + serie_num
-    
+        serie = serie.upper()
+        return f"nfse_{cnpj}_{rps}_{nfse}_{serie}".lower().rsplit('_', 1)[0] + '_' + serie
+
     # Garante que o prefixo "nfse" seja sempre minúsculo
-    return f"nfse_{cnpj}_{rps_num}_{nfse_num}_{serie_num}".lower()
+    return f"nfse_{cnpj}_{rps}_{nfse}_{serie}".lower()
+
+def _page_size(pdf):
+    page = pdf.pages[0]
+    return (round(page.width), round(page.height))
+
+def _search_cropped(pdf, box, regex):
+    """
+    Procura regex apenas na região box (page.crop); retorna o match ou None.
+    Também retorna None se o valor encontrado termina junto à borda direita/inferior
+    do recorte (valor mais longo que o do template, possivelmente cortado).
+    """
+    page_number, x0, top, x1, bottom = box
+    if page_number >= len(pdf.pages):
+        return None
+    page = pdf.pages[page_number]
+    page_x0, page_top, page_x1, page_bottom = page.bbox
+    bbox = (
+        max(page_x0, x0 - LAYOUT_PADDING),
+        max(page_top, top - LAYOUT_PADDING),
+        min(page_x1, x1 + LAYOUT_PADDING_RIGHT),
+        min(page_bottom, bottom + LAYOUT_PADDING),
+    )
+    found = page.crop(bbox).search(regex, regex=True, return_chars=False)
+    if not found:
+        return None
+    hit = found[0]
+    if bbox[2] < page_x1 and hit["x1"] > bbox[2] - LAYOUT_EDGE_MARGIN:
+        return None
+    if bbox[3] < page_bottom and hit["bottom"] > bbox[3] - LAYOUT_EDGE_MARGIN:
+        return None
+    return re.search(regex, hit["text"])
+
+def _extract_fields_cropped(pdf, boxes):
+    """
+    Extrai os campos apenas das regiões informadas.
+    Retorna None se algum campo não for encontrado (ou sair cortado) na sua região:
+    nesse caso vale a extração completa.
+    """
+    matches = {}
+    for field, regex in FIELD_REGEXES:
+        matches[field] = _search_cropped(pdf, boxes[field], regex)
+        if not matches[field]:
+            return None
+    return _normalize_fields(matches)
+
+def _is_template_issuer(pdf, template):
+    """Confere, lendo só a região do CNPJ, se o PDF é do emitente do template."""
+    match = _search_cropped(pdf, template["boxes"]["cnpj"], REGEX_CNPJ)
+    return bool(match) and re.sub(r"\D", "", match.group(0)) == template["cnpj"]
+
+def _extract_with_layout_cache(pdf):
+    """
+    Tenta os templates em cache para o tamanho de página; retorna os campos ou None.
+    A região do CNPJ de cada template é lida primeiro: só os templates do próprio
+    emitente (no máximo layout_cache.MAX_CANDIDATES) seguem para a extração recortada.
+    """
+    page_size = _page_size(pdf)
+    tried = 0
+    for template in layout_cache.candidates(page_size):
+        try:
+            if not _is_template_issuer(pdf, template):
+                continue
+            fields = _extract_fields_cropped(pdf, template["boxes"])
+        except Exception:
+            fields = None
+        # O CNPJ extraído deve ser o do emitente do template
+        if fields and fields["cnpj"] == template["cnpj"]:
+            layout_cache.record_hit(template["cnpj"], page_size)
+            return fields
+        tried += 1
+        if tried >= layout_cache.MAX_CANDIDATES:
+            break
+    layout_cache.record_miss()
+    return None
+
+def _learn_layout(pdf, fields):
+    """
+    Localiza as regiões dos campos após um parsing completo e as registra no cache,
+    desde que a extração recortada reproduza exatamente os mesmos valores.
+    Emitentes que já têm template para o tamanho de página não são reaprendidos.
+    """
+    if layout_cache.has(fields["cnpj"], _page_size(pdf)):
+        return
+    boxes = {}
+    for field, regex in FIELD_REGEXES:
+        for page_number, page in enumerate(pdf.pages[:LAYOUT_MAX_PAGES]):
+            found = page.search(regex, regex=True, return_chars=False)
+            if found:
+                match = found[0]
+                boxes[field] = [page_number, match["x0"], match["top"], match["x1"], match["bottom"]]
+                break
+        else:
+            return
+
+    if _extract_fields_cropped(pdf, boxes) == fields:
+        layout_cache.learn(fields["cnpj"], _page_size(pdf), boxes)
+
+def find_sibling_xml(pdf_path):
+    """Retorna o XML com o mesmo nome base do PDF (.xml ou .XML), ou None."""
+    base = os.path.splitext(pdf_path)[0]
+    for ext in (".xml", ".XML"):
+        if os.path.isfile(base + ext):
+            return base + ext
+    return None
+
+def extract_nfse_info_from_xml(xml_source, name_rule=None):
+    """Extrai informações de NFSe do XML e retorna o nome do arquivo."""
+    return build_name(extract_nfse_fields_from_xml(xml_source), name_rule)
+
+def extract_nfse_fields_from_xml(xml_source):
+    """
+    Extrai os campos da NFSe do XML (layouts ABRASF 1.x e 2.x) com iterparse,
+    sem carregar o documento inteiro: a leitura para assim que os quatro campos são encontrados.
+    - NFSe: InfNfse/Numero
+    - RPS e Série: IdentificacaoRps/Numero e IdentificacaoRps/Serie
+    - CNPJ: primeiro Cnpj dentro do prestador (Prestador*, IdentificacaoPrestador)
+    """
+    fields = {}
+    stack = []
+    try:
+        for event, elem in ET.iterparse(xml_source, events=("start", "end")):
+            tag = elem.tag.rsplit("}", 1)[-1]  # Remove namespace
+            if event == "start":
+                stack.append(tag)
+                continue
+
+            parent = stack[-2] if len(stack) > 1 else ""
+            text = (elem.text or "").strip()
+            if text:
+                if tag == "Numero" and parent == "InfNfse":
+                    fields.setdefault("nfse", text)
+                elif tag == "Numero" and parent == "IdentificacaoRps":
+                    fields.setdefault("rps", text)
+                elif tag == "Serie" and parent == "IdentificacaoRps":
+                    fields.setdefault("serie", text)
+                elif tag == "Cnpj" and any(t.startswith("Prestador") or t == "IdentificacaoPrestador" for t in stack):
+                    fields.setdefault("cnpj", text)
+            stack.pop()
+            elem.clear()
+            if len(fields) == 4:
+                break
+    except ET.ParseError as e:
+        raise ValueError(f"XML da NFSe inválido: {e}")
+
+    errors = {
+        "cnpj": "CNPJ do prestador não encontrado no XML.",
+        "nfse": "Número da NFSe não encontrado no XML.",
+        "rps": "Número RPS não encontrado no XML.",
+        "serie": "Série não encontrada no XML.",
+    }
+    for field, _ in FIELD_REGEXES:
+        if field not in fields:
+            raise ValueError(errors[field])
+
+    cnpj = re.sub(r"\D", "", fields["cnpj"])
+    if len(cnpj) != 14 or not fields["nfse"].isdigit() or not fields["rps"].isdigit():
+        raise ValueError("Campos do XML da NFSe em formato inesperado.")
+    # Mesmo conjunto de caracteres da série lida do PDF: "/", espaços ou acentos no nome do arquivo
+    # fariam o armazenamento falhar ou gerar nomes inesperados
+    if not re.fullmatch(SERIE_CHARSET, fields["serie"]):
+        raise ValueError(f"Série do XML da NFSe com caracteres inválidos: {fields['serie']!r}.")
+    return {"cnpj": cnpj, "rps": fields["rps"], "nfse": str(int(fields["nfse"])), "serie": fields["serie"]}
+
+def extract_nfse_info(pdf_path, xml_path=None, name_rule=None):
+    """
+    Extrai informações de NFSe do PDF e retorna o nome do arquivo
+    (name_rule, o NAME_RULE da fonte, substitui o nome padrão).
+    """
+    return build_name(extract_nfse_fields(pdf_path, xml_path), name_rule)
+
+def extract_nfse_fields(pdf_path, xml_path=None):
+    """
+    Extrai os campos da NFSe do PDF: {"cnpj", "rps", "nfse", "serie"}.
+    pdf_path pode ser um caminho ou um arquivo em memória (ex: io.BytesIO).
+    Se pdf_path for um XML, ou se xml_path (XML irmão) for informado, o XML é a fonte
+    dos campos; se o XML irmão for inválido ou incompleto, recorre ao texto do PDF.
+    Com o cache de layout ativo, tenta primeiro as regiões conhecidas do emitente
+    e recorre à extração da página inteira em caso de falha.
+    Trata erros específicos do pdfplumber.
+    """
+    if isinstance(pdf_path, str) and pdf_path.lower().endswith(".xml"):
+        return extract_nfse_fields_from_xml(pdf_path)
+    if xml_path:
+        try:
+            return extract_nfse_fields_from_xml(xml_path)
+        except (ValueError, OSError):
+            pass  # XML irmão inválido: segue para a extração do PDF
+
+    import pdfplumber
+    
+    try:
+        pdf = pdfplumber.open(pdf_path)
+    except Exception as e:
+        raise _translate_pdf_error(e)
+
+    with pdf:
+        try:
+            if layout_cache.ENABLED and pdf.pages:
+                fields = _extract_with_layout_cache(pdf)
+                if fields:
+                    return fields
+            full_text = "\n".join([p.extract_text() or "" for p in pdf.pages])
+        except Exception as e:
+            raise _translate_pdf_error(e)
+
+        fields = _parse_fields(full_text)
+
+        # Nenhum template serviu: aprende o layout, se o emitente ainda não tiver template
+        if layout_cache.ENABLED:
+            try:
+                _learn_layout(pdf, fields)
+            except Exception:
+                pass  # Aprendizado é opcional: falha não afeta a extração
 
+    return fields
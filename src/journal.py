@@ -0,0 +1,175 @@
+"""
+Journal (write-ahead) dos estados de processamento de cada arquivo.
+
+Cada transição é anexada a um arquivo JSON Lines em STATE_DIR, identificada pelo
+caminho original do arquivo:
+
+    reservado → extraido → armazenando → armazenado/enviado → concluido
+    (ou rejeitado/revertido)
+
+As transições que antecedem um passo irreversível (mover para o destino, remover
+o original após o upload FTP) são gravadas com fsync antes desse passo. O fsync
+é agrupado (group commit): as threads que aguardam durabilidade ao mesmo tempo
+são atendidas por uma única chamada. Na inicialização, as entradas sem estado
+final são devolvidas ao serviço, que conclui ou reverte o trabalho interrompido
+sem varrer OUTPUT_DIR.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+FINAL_STATES = ("concluido", "rejeitado", "revertido")
+STORED_STATES = ("armazenado", "enviado")
+COMPACT_AFTER = 10000  # Registros gravados antes de truncar o journal (sem entradas em aberto)
+
+ENABLED = False  # Ativado pelo serviço via open_journal()
+
+_COND = threading.Condition()
+_OPEN = {}  # caminho original -> estado acumulado da entrada em aberto
+_file = None
+_lock_file = None
+_seq = 0  # Último registro gravado
+_synced = 0  # Último registro garantido em disco (fsync)
+_syncing = False
+_written = 0  # Registros no arquivo desde a última compactação
+
+def open_journal(journal_file):
+    """
+    Ativa o journal e retorna as entradas interrompidas da execução anterior
+    (caminho -> estado acumulado). Reescreve o arquivo apenas com essas entradas.
+    Retorna None se outro processo (ex: o serviço, durante um comando da CLI) já usa o journal.
+    """
+    global ENABLED, _file, _lock_file, _written
+    os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+
+    lock_file = open(journal_file + ".lock", "a")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        logging.warning(f"Journal em uso por outro processo, seguindo sem journal: {journal_file}")
+        return None
+
+    pending = read_pending(journal_file)
+
+    tmp_file = journal_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        for entry in pending.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, journal_file)
+
+    with _COND:
+        _lock_file = lock_file
+        _file = open(journal_file, "a", encoding="utf-8")
+        _OPEN.clear()
+        _OPEN.update({path: dict(entry) for path, entry in pending.items()})
+        _written = len(pending)
+        ENABLED = True
+    logging.info(f"Journal de estados aberto: {len(pending)} entrada(s) interrompida(s) em {journal_file}")
+    return pending
+
+def read_pending(journal_file):
+    """Lê o journal (sem abri-lo para escrita) e retorna as entradas sem estado final."""
+    pending = {}
+    if os.path.exists(journal_file):
+        with open(journal_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Linha truncada por encerramento abrupto
+                if entry["estado"] in FINAL_STATES:
+                    pending.pop(entry["arquivo"], None)
+                else:
+                    pending.setdefault(entry["arquivo"], {}).update(entry)
+    return pending
+
+def _wait_synced(seq):
+    """Aguarda o fsync do registro seq (chamado com _COND adquirido)."""
+    global _synced, _syncing
+    while _synced < seq:
+        if _syncing:
+            # Outra thread está sincronizando: o fsync seguinte cobre este registro
+            _COND.wait()
+            continue
+        _syncing = True
+        target = _seq
+        try:
+            _file.flush()
+            fd = _file.fileno()
+            _COND.release()
+            try:
+                os.fsync(fd)
+            finally:
+                _COND.acquire()
+        except OSError as e:
+            logging.warning(f"Erro ao sincronizar journal: {e}")
+        finally:
+            _synced = max(_synced, target)
+            _syncing = False
+            _COND.notify_all()
+
+def _compact():
+    """Trunca o journal quando não há entradas em aberto (chamado com _COND adquirido)."""
+    global _written, _synced
+    try:
+        _file.flush()
+        _file.truncate(0)
+        _written = 0
+        _synced = _seq
+    except OSError as e:
+        logging.warning(f"Erro ao compactar journal: {e}")
+
+def log(path, estado, sync=False, **dados):
+    """
+    Registra a transição de estado do arquivo.
+    Com sync=True, só retorna após o registro estar em disco (fsync agrupado).
+    """
+    global _seq, _written
+    if not ENABLED:
+        return
+    entry = {"arquivo": path, "estado": estado, "ts": time.time(), **dados}
+    with _COND:
+        try:
+            _file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Erro ao gravar journal: {e}")
+            return
+        _seq += 1
+        _written += 1
+        if estado in FINAL_STATES:
+            _OPEN.pop(path, None)
+            if not _OPEN and _written >= COMPACT_AFTER and not _syncing:
+                _compact()
+        else:
+            _OPEN.setdefault(path, {}).update(entry)
+        if sync:
+            _wait_synced(_seq)
+
+def get(path):
+    """Estado acumulado da entrada em aberto do arquivo, ou None."""
+    with _COND:
+        entry = _OPEN.get(path)
+        return dict(entry) if entry else None
+
+def release(path):
+    """Encerra a entrada do arquivo se ainda estiver em aberto (concluída se já armazenado, senão revertida)."""
+    entry = get(path)
+    if entry:
+        log(path, "concluido" if entry["estado"] in STORED_STATES else "revertido")
+
+def close_journal():
+    """Grava e sincroniza os registros pendentes (encerramento do serviço)."""
+    global ENABLED
+    with _COND:
+        if not ENABLED:
+            return
+        _wait_synced(_seq)
+        ENABLED = False
+        _file.close()
+        _lock_file.close()
@@ -0,0 +1,96 @@
+"""
+Cache de layouts de NFSe por emitente.
+
+Após o primeiro parsing completo de um emitente, guarda a posição (página e
+bounding box) dos quatro campos usados no nome do arquivo. Os próximos PDFs do
+mesmo emitente/template são lidos apenas nessas regiões.
+
+Chave do cache: CNPJ do emitente + dimensões da página. Um template só é usado
+depois que a região do CNPJ confirma o emitente; o layout aprendido de um
+emitente não é substituído por novos parsings completos.
+"""
+import json
+import logging
+import os
+import threading
+
+ENABLED = False  # Ativado pelo serviço via load_cache()
+MAX_CANDIDATES = 3  # Templates do emitente testados por PDF antes da extração completa
+
+LAYOUT_STATS = {"acertos": 0, "falhas": 0}
+
+_LOCK = threading.Lock()
+_CACHE = {}  # "cnpj|largura|altura" -> {"cnpj", "page_size", "boxes", "hits"}
+_CACHE_FILE = None
+
+def _key(cnpj, page_size):
+    return f"{cnpj}|{page_size[0]}|{page_size[1]}"
+
+def load_cache(cache_file, max_candidates=3):
+    """Ativa o cache e carrega os layouts persistidos em cache_file."""
+    global ENABLED, MAX_CANDIDATES, _CACHE_FILE
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with _LOCK:
+        _CACHE_FILE = cache_file
+        MAX_CANDIDATES = max(1, max_candidates)
+        _CACHE.clear()
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, encoding="utf-8") as f:
+                    _CACHE.update(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Cache de layout ilegível, iniciando vazio: {e}")
+        ENABLED = True
+    logging.info(f"Cache de layout carregado: {len(_CACHE)} template(s) de {cache_file}")
+
+def _save():
+    """Persiste o cache (chamado com _LOCK adquirido)."""
+    if not _CACHE_FILE:
+        return
+    tmp_file = _CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(_CACHE, f)
+        os.replace(tmp_file, _CACHE_FILE)
+    except OSError as e:
+        logging.warning(f"Erro ao persistir cache de layout: {e}")
+
+def candidates(page_size):
+    """
+    Todos os templates com as mesmas dimensões de página, dos mais usados para os menos usados.
+    Cabe ao extrator confirmar o emitente pela região do CNPJ antes de usar cada um.
+    """
+    with _LOCK:
+        matching = [dict(entry) for entry in _CACHE.values() if tuple(entry["page_size"]) == tuple(page_size)]
+    matching.sort(key=lambda entry: entry["hits"], reverse=True)
+    return matching
+
+def has(cnpj, page_size):
+    """Indica se já existe template para o emitente nessas dimensões de página."""
+    with _LOCK:
+        return _key(cnpj, page_size) in _CACHE
+
+def learn(cnpj, page_size, boxes):
+    """Registra (ou substitui) o layout do emitente, mantendo a contagem de uso, e persiste o cache."""
+    key = _key(cnpj, page_size)
+    with _LOCK:
+        hits = _CACHE[key]["hits"] if key in _CACHE else 0
+        _CACHE[key] = {"cnpj": cnpj, "page_size": list(page_size), "boxes": boxes, "hits": hits}
+        _save()
+    logging.info(f"Layout aprendido para CNPJ {cnpj} (página {page_size[0]}x{page_size[1]})")
+
+def record_hit(cnpj, page_size):
+    with _LOCK:
+        LAYOUT_STATS["acertos"] += 1
+        entry = _CACHE.get(_key(cnpj, page_size))
+        if entry:
+            entry["hits"] += 1
+
+def record_miss():
+    with _LOCK:
+        LAYOUT_STATS["falhas"] += 1
+
+def format_stats():
+    """Resumo dos contadores para log."""
+    with _LOCK:
+        return f"{len(_CACHE)} template(s), {LAYOUT_STATS['acertos']} acerto(s), {LAYOUT_STATS['falhas']} falha(s)"
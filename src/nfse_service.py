@@ -3,25 +3,47 @@
 NFSe Renamer Service - Serviço principal
 """
 import os
+import io
+import errno
+import fcntl
+import json
+import hashlib
 import shutil
 import logging
 import signal
 import sys
 import stat
 import time
+import threading
 from time import sleep
-import ftplib
-from ftplib import FTP, FTP_TLS
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from .extract_nfse_info import extract_nfse_info
+from concurrent.futures import wait, FIRST_COMPLETED
+# ftplib, watchdog e pdfplumber (via extract_nfse_info) são importados no primeiro uso:
+# a inicialização e os subcomandos da CLI não pagam o custo de dependências que não usam
+from .extract_nfse_info import EXTRACTOR_VERSION, PdfminerException, build_name, extract_nfse_fields, find_sibling_xml
+from . import dedup
+from . import journal
+from . import layout_cache
+from . import output_packer
+from . import profiling
+from . import reject_ledger
+from . import scheduler
+from . import workers
+from .archive_ingest import ArchiveError, is_archive, iter_pdf_members
+from .pdf_prefilter import PdfEstruturaInvalida, check_pdf_structure
 
-CONFIG_FILE = "/opt/nfse-renamer/config.env"
+CONFIG_FILE = os.environ.get("NFSE_CONFIG_FILE", "/opt/nfse-renamer/config.env")  # caminho alternativo via ambiente
 CONFIG = {}
-PROCESSING_FILES = set()  # Controla arquivos em processamento
+SOURCES = []  # Fontes de entrada: configuração de cada fonte (CONFIG, se SOURCES não for definido)
+PROCESSING_FILES = set()  # Controla arquivos em processamento (caminho completo)
+DESTINATION_LOCK = threading.Lock()  # Escolha do nome de destino (arquivos processados em paralelo)
+RESERVED_DESTINATIONS = set()  # Destinos escolhidos cuja movimentação ainda não terminou
+XML_NAMES = {}  # XML avulso já processado: caminho sem extensão -> (campos da nota, horário)
+XML_NAMES_TTL = 3600  # segundos em que os campos do XML avulso são reaproveitados pelo PDF
+STATE_LOCK = None  # Lock de STATE_DIR/service.lock, mantido aberto pelo processo dono do estado
+RECOVERED_FILES = []  # Arquivos revertidos pelo journal ao iniciar: (caminho, fonte), reenfileirados pelo main
 
-def load_config():
-    """Carrega configurações do arquivo config.env"""
+def read_config():
+    """Lê o arquivo config.env e aplica os valores padrão, sem criar diretórios"""
     global CONFIG
     if not os.path.exists(CONFIG_FILE):
         raise FileNotFoundError(f"Arquivo de configuração não encontrado: {CONFIG_FILE}")
@@ -56,22 +78,135 @@ def load_config():
     CONFIG.setdefault("FTP_PASSIVE", "true")
     CONFIG.setdefault("FTP_TIMEOUT", "30")
     CONFIG.setdefault("FTP_USE_TLS", "false")
+    CONFIG.setdefault("STATE_DIR", "/opt/nfse-renamer/state")  # estado interno do serviço
+    CONFIG.setdefault("DEDUP_POLICY", "off")  # off, skip, link ou version
+    CONFIG.setdefault("DEDUP_RETENTION_DAYS", "90")  # dias mantidos no índice de duplicatas
+    CONFIG.setdefault("MAX_WORKERS", "4")  # workers que processam os arquivos de todas as fontes
+    CONFIG.setdefault("ARCHIVE_INGEST", "false")  # aceitar pacotes ZIP/TAR em INPUT_DIR
+    CONFIG.setdefault("ARCHIVE_MAX_MEMBER_MB", "50")  # tamanho máximo de cada PDF dentro do pacote
+    CONFIG.setdefault("PREFILTER_ENABLED", "true")  # pré-filtro estrutural antes do pdfplumber
+    CONFIG.setdefault("XML_INGEST", "false")  # usar XML da NFSe como fonte dos campos
+    CONFIG.setdefault("JOURNAL_ENABLED", "true")  # journal de estados para recuperação após queda
+    CONFIG.setdefault("LAYOUT_CACHE_ENABLED", "false")  # extração recortada por layout do emitente
+    CONFIG.setdefault("LAYOUT_MAX_CANDIDATES", "3")  # templates do emitente testados antes da extração completa
+    CONFIG.setdefault("PROFILE_MODE", "off")  # off, cprofile, tracemalloc ou both
+    CONFIG.setdefault("PROFILE_SAMPLE_RATE", "1.0")  # fração dos arquivos perfilados (0.0 a 1.0)
+    CONFIG.setdefault("PROFILE_KEEP", "10")  # perfis mantidos (N mais lentos e N mais pesados)
+    CONFIG.setdefault("PROFILE_DIR", os.path.join(CONFIG["STATE_DIR"], "profiles"))
+    CONFIG.setdefault("PACK_ENABLED", "false")  # empacotar arquivos antigos de OUTPUT_DIR
+    CONFIG.setdefault("PACK_AFTER_DAYS", "30")  # idade mínima (dias) dos arquivos empacotados
+    CONFIG.setdefault("PACK_INTERVAL", "3600")  # segundos entre rodadas de empacotamento
+    CONFIG.setdefault("PACK_BATCH_SIZE", "5000")  # arquivos por rodada
+    CONFIG.setdefault("PACK_DIR", os.path.join(CONFIG["OUTPUT_DIR"], "pacotes"))
+    CONFIG.setdefault("SINGLE_READ_MAX_MB", "64")  # arquivos até este tamanho são lidos uma única vez para a memória
+    CONFIG.setdefault("SOURCES", "")  # fontes de entrada nomeadas (ex: "matriz,filial")
+    CONFIG.setdefault("RECURSIVE", "false")  # monitorar também as subpastas de INPUT_DIR
+    CONFIG.setdefault("NAME_RULE", "")  # modelo do nome final (vazio: nfse_{cnpj}_{rps}_{nfse}_{serie})
+    CONFIG.setdefault("WEIGHT", "1")  # peso da fonte no escalonador
     
-    # Verifica modo RENAME_IN_PLACE
-    rename_in_place = CONFIG.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
+    SOURCES[:] = build_sources()
+
+# Chaves que cada fonte pode sobrescrever com SOURCE_<NOME>_<CHAVE>
+SOURCE_KEYS = (
+    "INPUT_DIR", "OUTPUT_DIR", "PACK_DIR", "RECURSIVE", "RENAME_IN_PLACE", "NAME_RULE", "WEIGHT",
+    "USE_FTP", "FTP_HOST", "FTP_PORT", "FTP_USER", "FTP_PASSWORD", "FTP_PATH",
+    "FTP_PASSIVE", "FTP_TIMEOUT", "FTP_USE_TLS",
+)
+
+def build_sources():
+    """
+    Monta a configuração de cada fonte de SOURCES: a configuração global
+    sobrescrita pelas chaves SOURCE_<NOME>_<CHAVE>. Sem SOURCES, a única fonte é CONFIG.
+    """
+    names = [name.strip() for name in CONFIG["SOURCES"].split(",") if name.strip()]
+    if not names:
+        validate_name_rule(CONFIG["NAME_RULE"])
+        return [CONFIG]
     
-    # INPUT_DIR sempre é necessário
-    dirs_to_manage = ["INPUT_DIR"]
+    sources = []
+    for name in names:
+        prefix = f"SOURCE_{name.upper()}_"
+        if prefix + "INPUT_DIR" not in CONFIG:
+            raise ValueError(f"{prefix}INPUT_DIR não configurado para a fonte {name}")
+        source_cfg = dict(CONFIG)
+        source_cfg["NAME"] = name
+        for key in SOURCE_KEYS:
+            if prefix + key in CONFIG:
+                source_cfg[key] = CONFIG[prefix + key]
+        # Cada OUTPUT_DIR tem os seus pacotes (padrão: <OUTPUT_DIR>/pacotes)
+        if prefix + "PACK_DIR" not in CONFIG and source_cfg["OUTPUT_DIR"] != CONFIG["OUTPUT_DIR"]:
+            source_cfg["PACK_DIR"] = os.path.join(source_cfg["OUTPUT_DIR"], "pacotes")
+        validate_name_rule(source_cfg["NAME_RULE"])
+        sources.append(source_cfg)
+    return sources
+
+def validate_name_rule(rule):
+    """
+    Valida o modelo NAME_RULE: apenas os campos {cnpj}, {rps}, {nfse} e {serie},
+    sem separadores de diretório e sem o prefixo NFSE_ dos arquivos de entrada
+    (com RENAME_IN_PLACE, o arquivo renomeado seria processado novamente).
+    """
+    if not rule:
+        return
+    try:
+        sample = rule.format(cnpj="0", rps="0", nfse="0", serie="0")
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"NAME_RULE inválido ({rule}): {e}")
+    if any(sep and sep in sample for sep in ("/", os.sep, os.altsep)):
+        raise ValueError(f"NAME_RULE inválido ({rule}): separador de diretório não permitido")
+    if sample.startswith("NFSE_"):
+        raise ValueError(f"NAME_RULE inválido ({rule}): o prefixo NFSE_ é reservado aos arquivos de entrada")
+
+def source_name(source_cfg):
+    return source_cfg.get("NAME", "padrao")
+
+def get_source(name):
+    """Configuração da fonte pelo nome (a primeira fonte, se o nome não existir mais)"""
+    for source_cfg in SOURCES:
+        if source_name(source_cfg) == name:
+            return source_cfg
+    return SOURCES[0]
+
+def pack_targets():
+    """
+    Pares (OUTPUT_DIR, PACK_DIR) das fontes, sem repetição, para o empacotamento.
+    Fontes em modo RENAME_IN_PLACE não usam OUTPUT_DIR e ficam de fora.
+    """
+    targets = {}
+    for source_cfg in SOURCES:
+        if source_cfg.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes"):
+            continue
+        targets.setdefault(os.path.abspath(source_cfg["OUTPUT_DIR"]), (source_cfg["OUTPUT_DIR"], source_cfg["PACK_DIR"]))
+    return list(targets.values())
+
+def is_packed(path):
+    """
+    Indica se o nome do arquivo já foi empacotado a partir da sua pasta (OUTPUT_DIR de uma fonte).
+    O empacotamento remove os arquivos de OUTPUT_DIR: sem esta verificação, um nome livre na pasta
+    poderia repetir um nome já empacotado.
+    """
+    directory = os.path.abspath(os.path.dirname(path))
+    for output_dir, pack_dir in pack_targets():
+        if os.path.abspath(output_dir) == directory:
+            return output_packer.is_packed(pack_dir, os.path.basename(path))
+    return False
+
+def load_config():
+    """Carrega configurações do arquivo config.env"""
+    read_config()
     
     # REJECT_DIR sempre é necessário (arquivos com erro são movidos para reject mesmo em RENAME_IN_PLACE)
-    # OUTPUT_DIR só é necessário se não estiver em modo RENAME_IN_PLACE
-    dirs_to_manage.append("REJECT_DIR")
-    if not rename_in_place:
-        dirs_to_manage.append("OUTPUT_DIR")
+    dirs_to_manage = [CONFIG["REJECT_DIR"]]
+    
+    for source_cfg in SOURCES:
+        # INPUT_DIR sempre é necessário
+        dirs_to_manage.append(source_cfg["INPUT_DIR"])
+        # OUTPUT_DIR só é necessário se não estiver em modo RENAME_IN_PLACE
+        if source_cfg.get("RENAME_IN_PLACE", "false").lower() not in ("true", "1", "yes"):
+            dirs_to_manage.append(source_cfg["OUTPUT_DIR"])
     
     # Criar diretórios se não existirem e ajustar permissões
-    for dir_key in dirs_to_manage:
-        dir_path = CONFIG[dir_key]
+    for dir_path in dict.fromkeys(dirs_to_manage):
         
         # Verifica se diretório já existe
         if not os.path.exists(dir_path):
@@ -249,42 +384,47 @@ def fix_all_permissions():
     if CONFIG.get("FIX_PERMISSIONS_ON_CYCLE", "true").lower() not in ("true", "1", "yes"):
         return
     
-    rename_in_place = CONFIG.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
-    
-    # Ajusta permissões dos diretórios (apenas se existirem)
-    if os.path.exists(CONFIG["INPUT_DIR"]):
-        set_directory_permissions(CONFIG["INPUT_DIR"])
-    
     # REJECT_DIR sempre é usado (arquivos com erro são movidos para reject)
     if os.path.exists(CONFIG["REJECT_DIR"]):
         set_directory_permissions(CONFIG["REJECT_DIR"])
         fix_permissions_in_directory(CONFIG["REJECT_DIR"])
     
-    # OUTPUT_DIR só é usado se não estiver em modo RENAME_IN_PLACE
-    if not rename_in_place:
-        if os.path.exists(CONFIG["OUTPUT_DIR"]):
-            set_directory_permissions(CONFIG["OUTPUT_DIR"])
-            fix_permissions_in_directory(CONFIG["OUTPUT_DIR"])
-    else:
-        # No modo RENAME_IN_PLACE, ajusta permissões também em INPUT_DIR
-        if os.path.exists(CONFIG["INPUT_DIR"]):
-            fix_permissions_in_directory(CONFIG["INPUT_DIR"])
+    for source_cfg in SOURCES:
+        rename_in_place = source_cfg.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
+        
+        # Ajusta permissões dos diretórios (apenas se existirem)
+        if os.path.exists(source_cfg["INPUT_DIR"]):
+            set_directory_permissions(source_cfg["INPUT_DIR"])
+        
+        # OUTPUT_DIR só é usado se não estiver em modo RENAME_IN_PLACE
+        if not rename_in_place:
+            if os.path.exists(source_cfg["OUTPUT_DIR"]):
+                set_directory_permissions(source_cfg["OUTPUT_DIR"])
+                fix_permissions_in_directory(source_cfg["OUTPUT_DIR"])
+        else:
+            # No modo RENAME_IN_PLACE, ajusta permissões também em INPUT_DIR
+            if os.path.exists(source_cfg["INPUT_DIR"]):
+                fix_permissions_in_directory(source_cfg["INPUT_DIR"])
 
-def upload_to_ftp(local_file_path, remote_filename):
+def upload_to_ftp(local_file_path, remote_filename, fileobj=None, source_cfg=None):
     """
     Faz upload de arquivo para servidor FTP.
     Suporta FTP anônimo (sem user/password) e autenticado.
+    Se fileobj for informado, envia o conteúdo em memória em vez de ler local_file_path.
     Retorna True se bem-sucedido, False caso contrário.
     """
+    import ftplib
+    
+    source_cfg = source_cfg or CONFIG
     try:
-        ftp_host = CONFIG.get("FTP_HOST", "").strip()
-        ftp_port = int(CONFIG.get("FTP_PORT", "21"))
-        ftp_user = CONFIG.get("FTP_USER", "").strip()
-        ftp_password = CONFIG.get("FTP_PASSWORD", "").strip()
-        ftp_path = CONFIG.get("FTP_PATH", "/").strip()
-        ftp_passive = CONFIG.get("FTP_PASSIVE", "true").lower() in ("true", "1", "yes")
-        ftp_timeout = int(CONFIG.get("FTP_TIMEOUT", "30"))
-        use_tls = CONFIG.get("FTP_USE_TLS", "false").lower() in ("true", "1", "yes")
+        ftp_host = source_cfg.get("FTP_HOST", "").strip()
+        ftp_port = int(source_cfg.get("FTP_PORT", "21"))
+        ftp_user = source_cfg.get("FTP_USER", "").strip()
+        ftp_password = source_cfg.get("FTP_PASSWORD", "").strip()
+        ftp_path = source_cfg.get("FTP_PATH", "/").strip()
+        ftp_passive = source_cfg.get("FTP_PASSIVE", "true").lower() in ("true", "1", "yes")
+        ftp_timeout = int(source_cfg.get("FTP_TIMEOUT", "30"))
+        use_tls = source_cfg.get("FTP_USE_TLS", "false").lower() in ("true", "1", "yes")
         
         if not ftp_host:
             logging.error("FTP_HOST não configurado")
@@ -292,7 +432,7 @@ def upload_to_ftp(local_file_path, remote_filename):
         
         # Conecta ao servidor FTP
         if use_tls:
-            ftp = FTP_TLS()
+            ftp = ftplib.FTP_TLS()
             ftp.connect(ftp_host, ftp_port, timeout=ftp_timeout)
             # Login: usa credenciais se fornecidas, senão tenta anônimo
             if ftp_user:
@@ -301,7 +441,7 @@ def upload_to_ftp(local_file_path, remote_filename):
                 ftp.login()  # Login anônimo
             ftp.prot_p()  # Protege a conexão de dados
         else:
-            ftp = FTP()
+            ftp = ftplib.FTP()
             ftp.connect(ftp_host, ftp_port, timeout=ftp_timeout)
             # Login: usa credenciais se fornecidas, senão tenta anônimo
             if ftp_user:
@@ -338,8 +478,11 @@ def upload_to_ftp(local_file_path, remote_filename):
                     logging.warning(f"Não foi possível criar/acessar diretório FTP: {ftp_path}")
         
         # Faz upload do arquivo
-        with open(local_file_path, 'rb') as file:
-            ftp.storbinary(f'STOR {remote_filename}', file)
+        if fileobj is not None:
+            ftp.storbinary(f'STOR {remote_filename}', fileobj)
+        else:
+            with open(local_file_path, 'rb') as file:
+                ftp.storbinary(f'STOR {remote_filename}', file)
         
         ftp.quit()
         
@@ -362,19 +505,147 @@ def should_process_file(filename):
     """
     Verifica se o arquivo deve ser processado.
     Processa apenas arquivos que começam com "NFSE" em maiúsculo.
+    Pacotes ZIP/TAR são aceitos com qualquer nome quando ARCHIVE_INGEST está ativo.
+    XMLs da NFSe (NFSE_*.xml) são aceitos quando XML_INGEST está ativo.
     """
-    if not filename.lower().endswith(".pdf"):
+    if is_archive(filename):
+        return CONFIG.get("ARCHIVE_INGEST", "false").lower() in ("true", "1", "yes")
+    
+    if filename.lower().endswith(".xml"):
+        if CONFIG.get("XML_INGEST", "false").lower() not in ("true", "1", "yes"):
+            return False
+    elif not filename.lower().endswith(".pdf"):
         return False
     
     # Processa apenas arquivos que começam com "NFSE" (maiúsculo)
     # Isso evita reprocessar arquivos já processados (que começam com "nfse" minúsculo)
     return filename.startswith("NFSE_")
 
-def check_if_file_was_processed(original_path):
+def get_dedup_policy():
+    """Retorna a política de deduplicação configurada ("off" se inválida)"""
+    policy = CONFIG.get("DEDUP_POLICY", "off").strip().lower()
+    return policy if policy in dedup.DEDUP_POLICIES else "off"
+
+def link_unique_file(destino, new_name):
+    """
+    Cria um hard link <new_name>_<timestamp> para destino, na mesma pasta e com a mesma extensão.
+    A criação do link é exclusiva: se o nome já existir (outra duplicata no mesmo segundo, ou já empacotado),
+    adiciona um sufixo, como em write_unique_file. Retorna o caminho do link.
+    """
+    directory = os.path.dirname(destino)
+    ext = os.path.splitext(destino)[1]
+    timestamp = int(time.time())
+    attempt = 1
+    while True:
+        link_path = os.path.join(directory, f"{new_name}_{timestamp}" + (f"_{attempt}" if attempt > 1 else "") + ext)
+        try:
+            if is_packed(link_path):
+                raise FileExistsError(link_path)
+            os.link(destino, link_path)
+            return link_path
+        except FileExistsError:
+            attempt += 1
+
+def document_ext(path):
+    """Tipo do documento para a deduplicação: .xml ou .pdf (inclusive membros de pacotes)"""
+    return ".xml" if path.lower().endswith(".xml") else ".pdf"
+
+def handle_duplicate(path, entry, tipo):
+    """
+    Aplica DEDUP_POLICY a um arquivo reenviado.
+    Retorna True se a duplicata foi suprimida (cabe ao chamador descartar a entrada),
+    False se o arquivo deve seguir o fluxo normal (política "version", ou entrada de
+    outro tipo de documento: o XML de uma nota não é duplicata do seu PDF).
+    """
+    if dedup.entry_ext(entry) != document_ext(path):
+        return False
+    policy = get_dedup_policy()
+    descricao = "mesmo conteúdo" if tipo == "conteudo" else "mesma chave CNPJ/RPS/NFSe/Série"
+    armazenado = entry.get("destino") or f"{entry['nome']}{dedup.entry_ext(entry)} (FTP)"
+    logging.info(f"Duplicata detectada ({descricao}): {path} → já armazenado como {armazenado}")
+    
+    if policy == "version":
+        dedup.count_duplicate(tipo, suppressed=False)
+        return False
+    
+    if policy == "link":
+        destino = entry.get("destino")
+        if destino and os.path.exists(destino):
+            try:
+                link_path = link_unique_file(destino, entry["nome"])
+                logging.info(f"Duplicata vinculada ao arquivo existente (hard link): {link_path} → {destino}")
+            except OSError as e:
+                logging.warning(f"Não foi possível criar hard link para duplicata, mantendo nova versão: {e}")
+                dedup.count_duplicate(tipo, suppressed=False)
+                return False
+        else:
+            logging.info(f"Destino local indisponível para vínculo, duplicata apenas descartada: {path}")
+    
+    dedup.count_duplicate(tipo, suppressed=True)
+    logging.info(f"Duplicata suprimida (DEDUP_POLICY={policy}): {path}")
+    return True
+
+def note_key(fields, ext=".pdf"):
+    """
+    Chave de deduplicação da nota (CNPJ, RPS, NFSe, Série): o nome padrão, sem NAME_RULE.
+    XMLs têm chave própria (<nome>.xml): um XML avulso não suprime o PDF da mesma nota.
+    """
+    key = build_name(fields)
+    return key if ext == ".pdf" else key + ext
+
+def entry_fields(entry):
+    """
+    Campos da nota de uma entrada do índice de deduplicação. Entradas antigas só
+    guardam o nome padrão, de onde os campos são recuperados; retorna None se o
+    nome não seguir o padrão nfse_<cnpj>_<rps>_<nfse>_<serie>.
+    """
+    if entry.get("campos"):
+        return entry["campos"]
+    parts = os.path.splitext(entry.get("chave", entry["nome"]))[0].split("_", 4)
+    if len(parts) != 5 or parts[0] != "nfse":
+        return None
+    return dict(zip(("cnpj", "rps", "nfse", "serie"), parts[1:]))
+
+def extract_with_dedup(label, source, digest, xml_path=None, fields=None, name_rule=None):
+    """
+    Obtém o nome de source (caminho ou arquivo em memória) conforme name_rule
+    (NAME_RULE da fonte), aplicando a deduplicação quando digest não é None.
+    xml_path (XML irmão) é repassado ao extrator; fields (campos já conhecidos)
+    dispensa a extração.
+    A deduplicação usa os campos da nota, não o nome formatado: a mesma nota
+    recebida por fontes com NAME_RULE diferentes é reconhecida como duplicata.
+    PDFs e XMLs são comparados apenas com documentos do mesmo tipo.
+    Retorna (nome, campos), ou None se a duplicata foi suprimida por DEDUP_POLICY.
+    """
+    ext = document_ext(label)
+    if digest is not None:
+        known = dedup.lookup_hash(digest)
+        if known and dedup.entry_ext(known) != ext:
+            known = None
+        if known:
+            if handle_duplicate(label, known, "conteudo"):
+                return None
+            # Política "version": reaproveita os campos já extraídos, sem novo parsing,
+            # e monta o nome com a regra da fonte atual
+            fields = fields or entry_fields(known)
+    
+    fields = fields or extract_nfse_fields(source, xml_path=xml_path)
+    new_name = build_name(fields, name_rule)
+    
+    # Deduplicação por chave (CNPJ, RPS, NFSe, Série) antes do armazenamento/upload
+    if digest is not None and not known:
+        known = dedup.lookup_key(note_key(fields, ext))
+        if known and handle_duplicate(label, known, "chave"):
+            return None
+    return new_name, fields
+
+def check_if_file_was_processed(original_path, source_cfg=None):
     """
     Verifica se o arquivo foi processado procurando pelo arquivo renomeado.
     Retorna o caminho do arquivo processado se encontrado, None caso contrário.
     """
+    source_cfg = source_cfg or CONFIG
+    
     # Obtém informações do arquivo original antes de procurar
     original_size = None
     original_mtime = None
@@ -388,7 +659,7 @@ def check_if_file_was_processed(original_path):
     except:
         pass
     
-    rename_in_place = CONFIG.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
+    rename_in_place = source_cfg.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
     original_dir = os.path.dirname(original_path)
     
     # Procura por arquivos processados
@@ -398,7 +669,7 @@ def check_if_file_was_processed(original_path):
         search_dirs.append(original_dir)
     else:
         # Em modo normal, procura em OUTPUT_DIR
-        search_dirs.append(CONFIG.get("OUTPUT_DIR", "/opt/nfse-renamer/files/processed"))
+        search_dirs.append(source_cfg.get("OUTPUT_DIR", "/opt/nfse-renamer/files/processed"))
     
     current_time = time.time()
     
@@ -440,11 +711,215 @@ def check_if_file_was_processed(original_path):
     
     return None
 
-def process_pdf(path, retry_count=0):
+def read_input_file(path):
+    """
+    Lê o arquivo inteiro para a memória (leitura única: pré-filtro, hash, extração e
+    upload FTP usam o mesmo conteúdo). Retorna None se o arquivo for maior que
+    SINGLE_READ_MAX_MB, caso em que cada etapa lê o arquivo do disco.
+    """
+    max_size = int(CONFIG["SINGLE_READ_MAX_MB"]) * 1024 * 1024
+    if os.path.getsize(path) > max_size:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+def move_file(path, destino, data=None):
+    """
+    Move o arquivo para destino. Entre sistemas de arquivos diferentes (EXDEV),
+    grava data (conteúdo já lido) no destino em vez de copiar, relendo, o original.
+    """
+    try:
+        os.rename(path, destino)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    if data is None:
+        shutil.move(path, destino)
+        return
+    with open(destino, "wb") as f:
+        f.write(data)
+    shutil.copystat(path, destino)
+    os.remove(path)
+
+def reserve_destination(dir_path, new_name, ext):
+    """
+    Escolhe o caminho de destino <new_name><ext> em dir_path (com timestamp se já existir,
+    já tiver sido empacotado ou estiver reservado por outro worker) e o reserva até release_destination().
+    O lock cobre apenas a escolha do nome: o fsync do journal e a movimentação ocorrem fora dele.
+    """
+    base_name = new_name
+    attempt = 0
+    with DESTINATION_LOCK:
+        while True:
+            destino = os.path.join(dir_path, base_name + ext)
+            if not os.path.exists(destino) and destino not in RESERVED_DESTINATIONS and not is_packed(destino):
+                RESERVED_DESTINATIONS.add(destino)
+                return destino
+            if attempt == 0:
+                logging.warning(f"Arquivo destino já existe, adicionando timestamp: {destino}")
+            attempt += 1
+            base_name = f"{new_name}_{int(time.time())}" + (f"_{attempt}" if attempt > 1 else "")
+
+def release_destination(destino):
+    with DESTINATION_LOCK:
+        RESERVED_DESTINATIONS.discard(destino)
+
+def store_processed_file(path, new_name, in_place_dir=None, ext=".pdf", source_cfg=None, data=None):
+    """
+    Renomeia/move/envia o arquivo já extraído para o destino configurado na fonte
+    (RENAME_IN_PLACE, USE_FTP ou OUTPUT_DIR).
+    in_place_dir define a pasta do modo RENAME_IN_PLACE (padrão: a pasta do próprio arquivo).
+    ext é a extensão do arquivo final (.pdf ou .xml).
+    data é o conteúdo já lido do arquivo (read_input_file): usado no upload FTP
+    e na gravação entre sistemas de arquivos, sem reler o arquivo do disco.
+    Retorna o caminho local final, ou None se o arquivo ficou apenas no FTP.
+    """
+    source_cfg = source_cfg or CONFIG
+    
+    # Verifica se deve renomear no lugar ou mover
+    rename_in_place = source_cfg.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
+    use_ftp = source_cfg.get("USE_FTP", "false").lower() in ("true", "1", "yes")
+    
+    if rename_in_place:
+        # Renomeia na própria pasta INPUT_DIR
+        dir_path = in_place_dir or os.path.dirname(path)
+        # Destino livre (timestamp adicionado se já existir)
+        destino = reserve_destination(dir_path, new_name, ext)
+        try:
+            # Renomeia arquivo (move_file: in_place_dir pode estar em outro sistema de arquivos)
+            journal.log(path, "armazenando", sync=True, destino=destino)
+            move_file(path, destino, data)
+        finally:
+            release_destination(destino)
+        journal.log(path, "armazenado", destino=destino)
+        
+        # Ajusta permissões do arquivo renomeado
+        set_file_permissions(destino)
+        
+        logging.info(f"Arquivo renomeado com sucesso → {destino}")
+        
+        # Se FTP estiver habilitado, também faz upload
+        if use_ftp:
+            remote_filename = os.path.basename(destino)
+            fileobj = io.BytesIO(data) if data is not None else None
+            if upload_to_ftp(destino, remote_filename, fileobj=fileobj, source_cfg=source_cfg):
+                logging.info(f"Arquivo também enviado para FTP: {remote_filename}")
+            else:
+                logging.warning(f"Falha ao enviar para FTP, mas arquivo local foi processado: {destino}")
+    
+    elif use_ftp:
+        # Modo FTP: faz upload e remove arquivo local após sucesso
+        remote_filename = new_name + ext
+        
+        fileobj = io.BytesIO(data) if data is not None else None
+        if upload_to_ftp(path, remote_filename, fileobj=fileobj, source_cfg=source_cfg):
+            destino = None  # Armazenado apenas no FTP
+            # Upload registrado antes da remoção: após uma queda, o original é apenas removido
+            journal.log(path, "enviado", sync=True, remoto=remote_filename)
+            # Remove arquivo local após upload bem-sucedido
+            try:
+                os.remove(path)
+                logging.info(f"Arquivo enviado para FTP e removido localmente: {remote_filename}")
+            except Exception as e:
+                logging.warning(f"Arquivo enviado para FTP, mas erro ao remover local: {e}")
+        else:
+            # Se falhar, move para OUTPUT_DIR como fallback
+            logging.warning(f"Falha no upload FTP, movendo para OUTPUT_DIR como fallback")
+            destino = reserve_destination(source_cfg["OUTPUT_DIR"], new_name, ext)
+            try:
+                journal.log(path, "armazenando", sync=True, destino=destino)
+                move_file(path, destino, data)
+            finally:
+                release_destination(destino)
+            journal.log(path, "armazenado", destino=destino)
+            set_file_permissions(destino)
+            logging.info(f"Arquivo movido para OUTPUT_DIR: {destino}")
+    
+    else:
+        # Comportamento padrão: move para OUTPUT_DIR
+        # Destino livre (timestamp adicionado se já existir)
+        destino = reserve_destination(source_cfg["OUTPUT_DIR"], new_name, ext)
+        try:
+            # Move arquivo (destino registrado antes: após uma queda, o journal indica onde concluir)
+            journal.log(path, "armazenando", sync=True, destino=destino)
+            move_file(path, destino, data)
+        finally:
+            release_destination(destino)
+        journal.log(path, "armazenado", destino=destino)
+        
+        # Ajusta permissões do arquivo processado
+        set_file_permissions(destino)
+        
+        logging.info(f"Arquivo processado com sucesso → {destino}")
+    
+    return destino
+
+def remember_xml_name(base_path, fields):
+    """Guarda os campos da nota extraídos de um XML avulso"""
+    now = time.time()
+    for key, (_, ts) in list(XML_NAMES.items()):
+        if now - ts > XML_NAMES_TTL:
+            XML_NAMES.pop(key, None)
+    XML_NAMES[base_path] = (fields, now)
+
+def pop_xml_name(base_path):
+    """Retorna (e remove) os campos extraídos do XML avulso de mesmo nome base, se recentes"""
+    entry = XML_NAMES.pop(base_path, None)
+    if entry and time.time() - entry[1] <= XML_NAMES_TTL:
+        return entry[0]
+    return None
+
+def store_sibling_xml(xml_path, new_name, pdf_destino, source_cfg=None):
+    """
+    Armazena o XML irmão com o mesmo nome final do PDF (extensão .xml),
+    no mesmo destino (pasta do PDF, FTP ou fallback em OUTPUT_DIR).
+    """
+    try:
+        if pdf_destino:
+            base_name = os.path.splitext(os.path.basename(pdf_destino))[0]
+            in_place_dir = os.path.dirname(pdf_destino)
+        else:
+            base_name = new_name
+            in_place_dir = None
+        store_processed_file(xml_path, base_name, in_place_dir=in_place_dir, ext=".xml", source_cfg=source_cfg)
+    except Exception as e:
+        logging.warning(f"PDF processado, mas erro ao armazenar XML irmão {xml_path}: {type(e).__name__}: {e}")
+    finally:
+        journal.release(xml_path)
+
+def reject_sibling_xml(pdf_path, reject_path):
+    """
+    Move o XML irmão do PDF rejeitado para REJECT_DIR, com o mesmo nome base do PDF
+    rejeitado: o reprocessamento volta a usá-lo, e ele não é processado sozinho em INPUT_DIR.
+    """
+    if pdf_path.lower().endswith(".xml") or CONFIG.get("XML_INGEST", "false").lower() not in ("true", "1", "yes"):
+        return
+    xml_path = find_sibling_xml(pdf_path)
+    if xml_path is None:
+        return
+    try:
+        xml_reject_path = os.path.splitext(reject_path)[0] + os.path.splitext(xml_path)[1]
+        shutil.move(xml_path, xml_reject_path)
+        set_file_permissions(xml_reject_path)
+        logging.error(f"XML irmão movido para REJECT: {xml_reject_path}")
+    except Exception as e:
+        logging.error(f"Erro ao mover XML irmão para REJECT: {xml_path}: {e}")
+
+def process_pdf(path, retry_count=0, source_cfg=None):
     """
     Processa PDF com retry logic e tratamento robusto de erros
+    (perfilado quando PROFILE_MODE está ativo).
+    source_cfg é a configuração da fonte de entrada (padrão: CONFIG).
+    """
+    with profiling.profile_file(path):
+        return _process_pdf(path, retry_count, source_cfg or CONFIG)
+
+def _process_pdf(path, retry_count, source_cfg):
     """
-    file_id = os.path.basename(path)
+    Processa PDF com retry logic e tratamento robusto de erros
+    """
+    file_id = path  # Caminho completo: fontes diferentes podem receber arquivos de mesmo nome
     
     # Evita processar o mesmo arquivo simultaneamente
     if file_id in PROCESSING_FILES:
@@ -459,7 +934,7 @@ def process_pdf(path, retry_count=0):
             logging.warning(f"Arquivo não encontrado: {path}")
             return False
         
-        if not path.lower().endswith(".pdf"):
+        if not path.lower().endswith((".pdf", ".xml")) and not is_archive(path):
             logging.debug(f"Ignorando arquivo não-PDF: {path}")
             return False
         
@@ -469,13 +944,13 @@ def process_pdf(path, retry_count=0):
             logging.debug(f"Ignorando arquivo em REJECT_DIR: {path}")
             return False
         
-        if CONFIG["OUTPUT_DIR"] in path or path.startswith(CONFIG["OUTPUT_DIR"]):
+        if source_cfg["OUTPUT_DIR"] in path or path.startswith(source_cfg["OUTPUT_DIR"]):
             logging.debug(f"Ignorando arquivo em OUTPUT_DIR: {path}")
             return False
         
         # Verifica se o arquivo está em INPUT_DIR (pasta de entrada)
         # Só processa arquivos que estão na pasta de entrada
-        if not path.startswith(CONFIG["INPUT_DIR"]):
+        if not path.startswith(source_cfg["INPUT_DIR"]):
             logging.debug(f"Ignorando arquivo fora de INPUT_DIR: {path}")
             return False
         
@@ -485,21 +960,61 @@ def process_pdf(path, retry_count=0):
             logging.debug(f"Ignorando arquivo (não começa com NFSE_): {path}")
             return False
         
+        # Pacotes ZIP/TAR têm fluxo próprio (membros processados em memória)
+        if is_archive(filename):
+            return process_archive(path, source_cfg)
+        
+        # XML com PDF irmão é consumido no processamento do PDF
+        is_xml = filename.lower().endswith(".xml")
+        base_path = os.path.splitext(path)[0]
+        if is_xml and (os.path.exists(base_path + ".pdf") or os.path.exists(base_path + ".PDF")):
+            logging.debug(f"XML será processado junto com o PDF irmão: {path}")
+            return False
+        
         # Aguarda arquivo estar pronto
         if not wait_for_file_ready(path):
             logging.warning(f"Arquivo não ficou disponível a tempo: {path}")
             if retry_count < int(CONFIG["MAX_RETRIES"]):
                 sleep(int(CONFIG["RETRY_DELAY"]))
                 PROCESSING_FILES.discard(file_id)
-                return process_pdf(path, retry_count + 1)
+                return process_pdf(path, retry_count + 1, source_cfg)
+            # No modo watchdog nenhum novo evento anuncia o arquivo: reagenda em vez de descartá-lo
+            if CONFIG["USE_POLLING"].lower() not in ("true", "1", "yes"):
+                reschedule_file(path, source_cfg)
             return False
+        profiling.mark("espera")
         
         logging.info(f"Processando arquivo: {path}")
+        journal.log(path, "reservado", origem=source_name(source_cfg))
+        
+        # Leitura única do PDF: as etapas seguintes usam o conteúdo em memória
+        data = None if is_xml else read_input_file(path)
+        profiling.mark("leitura")
+        
+        # Pré-filtro estrutural: rejeita PDFs corrompidos ou sem texto sem passar pelo pdfplumber
+        if not is_xml and CONFIG.get("PREFILTER_ENABLED", "true").lower() in ("true", "1", "yes"):
+            check_pdf_structure(data if data is not None else path)
+        profiling.mark("prefiltro")
+        
+        # Deduplicação por conteúdo: hash calculado antes de qualquer parsing
+        digest = None
+        if get_dedup_policy() != "off":
+            digest = hashlib.sha256(data).hexdigest() if data is not None else dedup.hash_file(path)
+        profiling.mark("hash")
+        
+        # XML da NFSe como fonte barata dos campos: XML irmão ou XML avulso já processado
+        xml_path = None
+        known_fields = None
+        if not is_xml and CONFIG.get("XML_INGEST", "false").lower() in ("true", "1", "yes"):
+            xml_path = find_sibling_xml(path)
+            if xml_path is None:
+                known_fields = pop_xml_name(base_path)
         
         # Processamento com timeout simulado
         start_time = time.time()
         try:
-            new_name = extract_nfse_info(path)
+            source = io.BytesIO(data) if data is not None else path
+            extracted = extract_with_dedup(path, source, digest, xml_path, known_fields, source_cfg["NAME_RULE"])
         except Exception as extract_error:
             # Log específico para erros durante extração
             logging.error(f"Erro durante extração de informações: {path}")
@@ -508,85 +1023,39 @@ def process_pdf(path, retry_count=0):
             # Relança a exceção para ser tratada no bloco except externo
             raise
         elapsed = time.time() - start_time
+        profiling.mark("extracao")
         
         if elapsed > int(CONFIG["PROCESS_TIMEOUT"]):
             logging.warning(f"Processamento demorou {elapsed:.2f}s (timeout: {CONFIG['PROCESS_TIMEOUT']}s)")
         
+        if extracted is None:
+            # Duplicata suprimida: descarta o arquivo de entrada (e o XML irmão)
+            os.remove(path)
+            if xml_path and os.path.exists(xml_path):
+                os.remove(xml_path)
+            journal.log(path, "concluido", suprimido=True)
+            return True
+        new_name, fields = extracted
+        journal.log(path, "extraido", nome=new_name, sha256=digest, campos=fields)
+        
         # Verifica se arquivo ainda existe antes de processar
         if not os.path.exists(path):
             logging.error(f"Arquivo foi removido durante processamento: {path}")
             return False
         
-        # Verifica se deve renomear no lugar ou mover
-        rename_in_place = CONFIG.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
-        use_ftp = CONFIG.get("USE_FTP", "false").lower() in ("true", "1", "yes")
+        destino = store_processed_file(path, new_name, ext=".xml" if is_xml else ".pdf", source_cfg=source_cfg, data=data)
         
-        if rename_in_place:
-            # Renomeia na própria pasta INPUT_DIR
-            dir_path = os.path.dirname(path)
-            destino = os.path.join(dir_path, new_name + ".pdf")
-            
-            # Verifica se destino já existe
-            if os.path.exists(destino):
-                logging.warning(f"Arquivo destino já existe, adicionando timestamp: {destino}")
-                base_name = new_name + "_" + str(int(time.time()))
-                destino = os.path.join(dir_path, base_name + ".pdf")
-            
-            # Renomeia arquivo
-            os.rename(path, destino)
-            
-            # Ajusta permissões do arquivo renomeado
-            set_file_permissions(destino)
-            
-            logging.info(f"Arquivo renomeado com sucesso → {destino}")
-            
-            # Se FTP estiver habilitado, também faz upload
-            if use_ftp:
-                remote_filename = os.path.basename(destino)
-                if upload_to_ftp(destino, remote_filename):
-                    logging.info(f"Arquivo também enviado para FTP: {remote_filename}")
-                else:
-                    logging.warning(f"Falha ao enviar para FTP, mas arquivo local foi processado: {destino}")
-        
-        elif use_ftp:
-            # Modo FTP: faz upload e remove arquivo local após sucesso
-            remote_filename = new_name + ".pdf"
-            
-            if upload_to_ftp(path, remote_filename):
-                # Remove arquivo local após upload bem-sucedido
-                try:
-                    os.remove(path)
-                    logging.info(f"Arquivo enviado para FTP e removido localmente: {remote_filename}")
-                except Exception as e:
-                    logging.warning(f"Arquivo enviado para FTP, mas erro ao remover local: {e}")
-            else:
-                # Se falhar, move para OUTPUT_DIR como fallback
-                logging.warning(f"Falha no upload FTP, movendo para OUTPUT_DIR como fallback")
-                destino = os.path.join(CONFIG["OUTPUT_DIR"], new_name + ".pdf")
-                if os.path.exists(destino):
-                    base_name = new_name + "_" + str(int(time.time()))
-                    destino = os.path.join(CONFIG["OUTPUT_DIR"], base_name + ".pdf")
-                shutil.move(path, destino)
-                set_file_permissions(destino)
-                logging.info(f"Arquivo movido para OUTPUT_DIR: {destino}")
+        if is_xml:
+            # XML avulso: o PDF que chegar depois reaproveita os campos sem parsing
+            remember_xml_name(base_path, fields)
+        elif xml_path and os.path.exists(xml_path):
+            store_sibling_xml(xml_path, new_name, destino, source_cfg)
         
-        else:
-            # Comportamento padrão: move para OUTPUT_DIR
-            destino = os.path.join(CONFIG["OUTPUT_DIR"], new_name + ".pdf")
-            
-            # Verifica se destino já existe
-            if os.path.exists(destino):
-                logging.warning(f"Arquivo destino já existe, adicionando timestamp: {destino}")
-                base_name = new_name + "_" + str(int(time.time()))
-                destino = os.path.join(CONFIG["OUTPUT_DIR"], base_name + ".pdf")
-            
-            # Move arquivo
-            shutil.move(path, destino)
-            
-            # Ajusta permissões do arquivo processado
-            set_file_permissions(destino)
-            
-            logging.info(f"Arquivo processado com sucesso → {destino}")
+        if digest is not None:
+            ext = document_ext(path)
+            dedup.register(digest, new_name, destino, note_key(fields, ext), fields, ext)
+        journal.log(path, "concluido", destino=destino)
+        profiling.mark("destino")
         
         return True
         
@@ -598,7 +1067,7 @@ def process_pdf(path, retry_count=0):
         if retry_count < int(CONFIG["MAX_RETRIES"]):
             sleep(int(CONFIG["RETRY_DELAY"]))
             PROCESSING_FILES.discard(file_id)
-            return process_pdf(path, retry_count + 1)
+            return process_pdf(path, retry_count + 1, source_cfg)
         return False
     except (Exception, BaseException) as e:
         # Log de erro com mais detalhes para diferentes tipos de erro
@@ -606,7 +1075,11 @@ def process_pdf(path, retry_count=0):
         error_msg = str(e)
         
         # Log mais detalhado para erros de leitura de PDF
-        if "PdfminerException" in error_type or "PdfminerException" in error_msg or "No /Root" in error_msg:
+        structural_reject = isinstance(e, PdfEstruturaInvalida)
+        if structural_reject:
+            logging.error(f"PDF rejeitado pelo pré-filtro estrutural: {path}")
+            logging.error(f"  Motivo: {error_msg}")
+        elif "PdfminerException" in error_type or "PdfminerException" in error_msg or "No /Root" in error_msg:
             logging.error(f"Erro do pdfminer ao ler PDF: {path}")
             logging.error(f"  Detalhes: {error_msg}")
             logging.error(f"  Verificando se arquivo foi processado antes do erro...")
@@ -622,20 +1095,32 @@ def process_pdf(path, retry_count=0):
             logging.error(f"Erro processando {path}: {error_type}: {error_msg}")
             logging.error(f"  Verificando se arquivo foi processado antes do erro...")
         
+        # Com o journal ativo, o estado registrado indica se o arquivo já foi armazenado/enviado
+        if journal.ENABLED:
+            entry = journal.get(path)
+            if entry and entry["estado"] in journal.STORED_STATES:
+                logging.info(f"Arquivo foi armazenado antes do erro (journal): {path} → {entry.get('destino') or 'FTP'}")
+                logging.info(f"  Não movendo para REJECT_DIR pois o processamento foi bem-sucedido")
+                return True
+        
         # PRIMEIRO: Verifica se o arquivo foi processado antes de mover para REJECT_DIR
         # Isso é importante porque mesmo com erro, o arquivo pode ter sido renomeado/movido com sucesso
-        processed_file = check_if_file_was_processed(path)
+        # (não se aplica à rejeição do pré-filtro, que ocorre antes de qualquer movimentação,
+        # nem a XMLs, cujo tamanho pequeno tornaria a comparação com os PDFs processados enganosa,
+        # nem quando o journal está ativo, pois ele já respondeu acima)
+        skip_processed_check = structural_reject or path.lower().endswith(".xml") or journal.ENABLED
+        processed_file = None if skip_processed_check else check_if_file_was_processed(path, source_cfg)
         if processed_file and os.path.exists(processed_file):
             logging.info(f"Arquivo foi processado com sucesso antes do erro: {path} → {processed_file}")
             logging.info(f"  Não movendo para REJECT_DIR pois o processamento foi bem-sucedido")
             return True  # Considera como sucesso pois foi processado
         
         # Se o arquivo original não existe mais e não encontramos processado, pode ter sido processado
-        if not os.path.exists(path):
+        if not os.path.exists(path) and not skip_processed_check:
             logging.warning(f"Arquivo não encontrado após erro - pode ter sido processado: {path}")
             # Tenta uma busca mais ampla por arquivos processados recentes
-            rename_in_place = CONFIG.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
-            search_dir = os.path.dirname(path) if rename_in_place else CONFIG.get("OUTPUT_DIR", "/opt/nfse-renamer/files/processed")
+            rename_in_place = source_cfg.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
+            search_dir = os.path.dirname(path) if rename_in_place else source_cfg.get("OUTPUT_DIR", "/opt/nfse-renamer/files/processed")
             if os.path.exists(search_dir):
                 try:
                     # Procura por qualquer arquivo "nfse_" processado nos últimos 10 segundos
@@ -660,7 +1145,7 @@ def process_pdf(path, retry_count=0):
             return False
         
         # Verifica se o arquivo ainda está em INPUT_DIR (não foi movido por outro processo)
-        if not path.startswith(CONFIG["INPUT_DIR"]):
+        if not path.startswith(source_cfg["INPUT_DIR"]):
             logging.warning(f"Arquivo não está mais em INPUT_DIR, não será movido para REJECT: {path}")
             return False
         
@@ -668,14 +1153,18 @@ def process_pdf(path, retry_count=0):
             reject_path = os.path.join(CONFIG["REJECT_DIR"], os.path.basename(path))
             # Evita sobrescrever arquivo existente em reject
             if os.path.exists(reject_path):
-                base_name = os.path.splitext(os.path.basename(path))[0]
+                base_name, ext = os.path.splitext(os.path.basename(path))
                 reject_path = os.path.join(
                     CONFIG["REJECT_DIR"], 
-                    f"{base_name}_{int(time.time())}.pdf"
+                    f"{base_name}_{int(time.time())}{ext}"
                 )
             
             # Move o arquivo para REJECT_DIR
             shutil.move(path, reject_path)
+            journal.log(path, "rejeitado", destino=reject_path)
+            reject_sibling_xml(path, reject_path)
+            reject_ledger.record(os.path.basename(reject_path), f"{error_type}: {error_msg}", EXTRACTOR_VERSION,
+                                 origem=source_cfg.get("NAME"), falha_extracao=is_extraction_error(e))
             
             # Ajusta permissões do arquivo rejeitado
             set_file_permissions(reject_path)
@@ -690,44 +1179,297 @@ def process_pdf(path, retry_count=0):
         
         return False
     finally:
+        journal.release(path)
         PROCESSING_FILES.discard(file_id)
 
-class NFSeHandler(FileSystemEventHandler):
-    """Handler para eventos do watchdog"""
-    def on_created(self, event):
-        if event.is_directory:
-            return
-        if not event.src_path.lower().endswith(".pdf"):
-            return
-        
-        # IMPORTANTE: Só processa arquivos que estão em INPUT_DIR
-        # Ignora arquivos criados em outras pastas (REJECT_DIR, OUTPUT_DIR, etc)
-        if not event.src_path.startswith(CONFIG["INPUT_DIR"]):
-            logging.debug(f"Arquivo detectado fora de INPUT_DIR, ignorando: {event.src_path}")
-            return
-        
-        # Processa apenas arquivos que começam com "NFSE" em maiúsculo
-        filename = os.path.basename(event.src_path)
-        if not should_process_file(filename):
-            logging.debug(f"Arquivo detectado mas ignorado (não começa com NFSE_): {filename}")
-            return
+def wait_for_archive_complete(file_path, max_wait=30):
+    """Aguarda o tamanho do pacote estabilizar (upload/cópia concluído)"""
+    last_size = -1
+    for _ in range(max_wait):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return False
+        if size == last_size and size > 0:
+            return True
+        last_size = size
+        sleep(1)
+    return False
+
+def write_unique_file(directory, new_name, data):
+    """
+    Grava os dados diretamente no destino final <new_name>.pdf.
+    Se o nome já existir (ou já tiver sido empacotado), adiciona timestamp, como no fluxo de arquivos avulsos.
+    A criação é exclusiva, evitando sobrescrever um destino gravado em paralelo por outro worker.
+    """
+    base_name = new_name
+    attempt = 0
+    while True:
+        destino = os.path.join(directory, base_name + ".pdf")
+        try:
+            if is_packed(destino):
+                raise FileExistsError(destino)
+            with open(destino, "xb") as f:
+                f.write(data)
+            return destino
+        except FileExistsError:
+            attempt += 1
+            base_name = f"{new_name}_{int(time.time())}" + (f"_{attempt}" if attempt > 1 else "")
+
+def store_processed_bytes(data, new_name, source_cfg=None):
+    """
+    Armazena um PDF mantido em memória (membro de pacote) no destino configurado,
+    seguindo as mesmas regras de process_pdf para RENAME_IN_PLACE e USE_FTP.
+    Retorna o caminho local gravado, ou None se armazenado apenas no FTP.
+    """
+    source_cfg = source_cfg or CONFIG
+    rename_in_place = source_cfg.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
+    use_ftp = source_cfg.get("USE_FTP", "false").lower() in ("true", "1", "yes")
+    
+    if rename_in_place:
+        destino = write_unique_file(source_cfg["INPUT_DIR"], new_name, data)
+        set_file_permissions(destino)
+        logging.info(f"Arquivo gravado com sucesso → {destino}")
+        if use_ftp:
+            remote_filename = os.path.basename(destino)
+            if upload_to_ftp(None, remote_filename, fileobj=io.BytesIO(data), source_cfg=source_cfg):
+                logging.info(f"Arquivo também enviado para FTP: {remote_filename}")
+            else:
+                logging.warning(f"Falha ao enviar para FTP, mas arquivo local foi gravado: {destino}")
+        return destino
+    
+    if use_ftp:
+        remote_filename = new_name + ".pdf"
+        if upload_to_ftp(None, remote_filename, fileobj=io.BytesIO(data), source_cfg=source_cfg):
+            return None
+        logging.warning(f"Falha no upload FTP, gravando em OUTPUT_DIR como fallback")
+    
+    destino = write_unique_file(source_cfg["OUTPUT_DIR"], new_name, data)
+    set_file_permissions(destino)
+    logging.info(f"Arquivo processado com sucesso → {destino}")
+    return destino
+
+def process_archive_member(archive_name, member_name, data, source_cfg=None):
+    """
+    Processa um PDF lido de um pacote, inteiramente em memória.
+    Retorna a entrada do relatório por membro.
+    """
+    source_cfg = source_cfg or CONFIG
+    report = {"membro": member_name}
+    label = f"{archive_name}:{member_name}"
+    try:
+        if CONFIG.get("PREFILTER_ENABLED", "true").lower() in ("true", "1", "yes"):
+            check_pdf_structure(data)
+        digest = hashlib.sha256(data).hexdigest() if get_dedup_policy() != "off" else None
+        extracted = extract_with_dedup(label, io.BytesIO(data), digest, name_rule=source_cfg["NAME_RULE"])
+        if extracted is None:
+            report["status"] = "duplicata"
+            return report
+        new_name, fields = extracted
+        
+        destino = store_processed_bytes(data, new_name, source_cfg)
+        if digest is not None:
+            dedup.register(digest, new_name, destino, note_key(fields), fields, ".pdf")
+        report["status"] = "processado"
+        report["destino"] = destino or f"{new_name}.pdf (FTP)"
+    except Exception as e:
+        motivo = f"{type(e).__name__}: {e}"
+        logging.error(f"Erro processando membro do pacote {label}: {motivo}")
+        report["status"] = "rejeitado"
+        report["motivo"] = motivo
+        try:
+            stem = os.path.splitext(os.path.basename(member_name))[0]
+            archive_stem = archive_name.split(".", 1)[0]
+            reject_path = write_unique_file(CONFIG["REJECT_DIR"], f"{archive_stem}__{stem}", data)
+            set_file_permissions(reject_path)
+            reject_ledger.record(os.path.basename(reject_path), motivo, EXTRACTOR_VERSION,
+                                 origem=source_cfg.get("NAME"), falha_extracao=is_extraction_error(e))
+            report["reject"] = reject_path
+        except Exception as move_error:
+            logging.error(f"Erro ao gravar membro rejeitado em REJECT: {move_error}")
+    return report
+
+def write_archive_report(archive_name, reports, resumo, motivo=None, report_name=None):
+    """
+    Grava o relatório por membro do pacote em REJECT_DIR, como <report_name>.relatorio.json
+    (padrão: o nome do pacote; com prefixo de timestamp se já existir um relatório com esse nome)
+    """
+    report_name = report_name or archive_name
+    report_path = os.path.join(CONFIG["REJECT_DIR"], f"{report_name}.relatorio.json")
+    if os.path.exists(report_path):
+        report_path = os.path.join(CONFIG["REJECT_DIR"], f"{int(time.time())}_{report_name}.relatorio.json")
+    content = {
+        "pacote": archive_name,
+        "data": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "motivo": motivo,
+        "resumo": resumo,
+        "membros": reports,
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(content, f, ensure_ascii=False, indent=2)
+    logging.error(f"Relatório do pacote gravado em: {report_path}")
+
+def process_archive(path, source_cfg=None):
+    """
+    Processa um pacote ZIP/TAR depositado no INPUT_DIR da fonte.
+    Os PDFs são lidos do pacote para a memória (sem arquivos temporários), enfileirados
+    no escalonador na fila da fonte e gravados diretamente com o nome final.
+    Membros com erro de extração vão para REJECT_DIR. Um pacote ilegível, sem PDFs ou com
+    PDFs que não puderam ser lidos (acima do limite, corrompidos, criptografados) é movido
+    inteiro para REJECT_DIR, preservando esses membros; os já entregues constam no relatório.
+    Em ambos os casos é gerado um relatório por membro em REJECT_DIR.
+    """
+    source_cfg = source_cfg or CONFIG
+    archive_name = os.path.basename(path)
+    if not wait_for_archive_complete(path):
+        logging.warning(f"Pacote não ficou disponível a tempo: {path}")
+        return False
+    
+    logging.info(f"Processando pacote: {path}")
+    max_workers = int(CONFIG["MAX_WORKERS"])
+    max_member_size = int(CONFIG["ARCHIVE_MAX_MEMBER_MB"]) * 1024 * 1024
+    reports = []
+    in_flight = set()
+    motivo = None
+    unread = 0  # PDFs rejeitados antes da leitura: só existem no próprio pacote
+    
+    try:
+        for member_name, data, member_error in iter_pdf_members(path, max_member_size):
+            if data is None:
+                status = "ignorado" if member_error.startswith("ignorado") else "rejeitado"
+                unread += status == "rejeitado"
+                reports.append({"membro": member_name, "status": status, "motivo": member_error})
+                continue
+            # Limita a quantidade de membros em memória aguardando processamento
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                reports.extend(future.result() for future in done)
+            in_flight.add(scheduler.submit_call(source_name(source_cfg), process_archive_member,
+                                                archive_name, member_name, data, source_cfg))
+    except ArchiveError as e:
+        motivo = str(e)
+    except Exception as e:
+        motivo = f"Erro ao ler pacote: {type(e).__name__}: {e}"
+    finally:
+        done, _ = wait(in_flight)
+        reports.extend(future.result() for future in done)
+    
+    pdf_reports = [entry for entry in reports if entry["status"] != "ignorado"]
+    if motivo is None and not pdf_reports:
+        motivo = "Pacote não contém PDFs"
+    if motivo is None and unread:
+        motivo = f"Rejeição parcial: {unread} PDF(s) não puderam ser lidos do pacote"
+    
+    resumo = {}
+    for entry in reports:
+        resumo[entry["status"]] = resumo.get(entry["status"], 0) + 1
+    logging.info(f"Pacote {archive_name}: {resumo}")
+    
+    try:
+        if motivo is not None:
+            # Pacote ilegível, sem PDFs ou com membros não lidos: o próprio pacote vai para REJECT_DIR
+            # (membros já entregues constam no relatório)
+            logging.error(f"Pacote rejeitado: {path} - {motivo}")
+            reject_path = os.path.join(CONFIG["REJECT_DIR"], archive_name)
+            if os.path.exists(reject_path):
+                reject_path = os.path.join(CONFIG["REJECT_DIR"], f"{int(time.time())}_{archive_name}")
+            shutil.move(path, reject_path)
+            write_archive_report(archive_name, reports, resumo, motivo, report_name=os.path.basename(reject_path))
+            return False
         
-        logging.info(f"Arquivo detectado pelo watchdog: {filename}")
-        # Processa em thread separada para não bloquear
-        process_pdf(event.src_path)
+        # Todos os membros já foram entregues ou gravados em REJECT_DIR
+        os.remove(path)
+        if resumo.get("rejeitado"):
+            write_archive_report(archive_name, reports, resumo)
+        return True
+    except Exception as e:
+        logging.error(f"Erro ao finalizar pacote {path}: {type(e).__name__}: {e}")
+        return False
+
+def create_event_handler(source_cfg):
+    """Cria o handler de eventos do watchdog da fonte (importado apenas no modo watchdog)"""
+    from watchdog.events import FileSystemEventHandler
+    
+    class NFSeHandler(FileSystemEventHandler):
+        """Handler para eventos do watchdog"""
+        def on_created(self, event):
+            if event.is_directory:
+                return
+            if not event.src_path.lower().endswith((".pdf", ".xml")) and not is_archive(event.src_path):
+                return
+            
+            # IMPORTANTE: Só processa arquivos que estão em INPUT_DIR
+            # Ignora arquivos criados em outras pastas (REJECT_DIR, OUTPUT_DIR, etc)
+            if not event.src_path.startswith(source_cfg["INPUT_DIR"]):
+                logging.debug(f"Arquivo detectado fora de INPUT_DIR, ignorando: {event.src_path}")
+                return
+            
+            # Processa apenas arquivos que começam com "NFSE" em maiúsculo
+            filename = os.path.basename(event.src_path)
+            if not should_process_file(filename):
+                logging.debug(f"Arquivo detectado mas ignorado (não começa com NFSE_): {filename}")
+                return
+            
+            logging.info(f"Arquivo detectado pelo watchdog: {filename}")
+            # Processa em thread separada para não bloquear
+            dispatch_file(event.src_path, source_cfg)
+    
+    return NFSeHandler()
+
+def dispatch_file(path, source_cfg):
+    """
+    Entrega o arquivo ao escalonador, na fila da sua fonte.
+    Pacotes vão para a thread leitora da fonte (não ocupam um worker nem a thread do
+    watchdog/polling); os seus membros voltam à fila da fonte, com o mesmo peso.
+    """
+    submit = scheduler.submit_archive if is_archive(path) else scheduler.submit
+    if not submit(source_name(source_cfg), path, source_cfg):
+        logging.debug(f"Arquivo já na fila de processamento: {path}")
 
-def scan_directory():
-    """Escaneia diretório em modo polling"""
-    logging.info(f"Verificando pasta: {CONFIG['INPUT_DIR']}")
+def reschedule_file(path, source_cfg):
+    """
+    Reenfileira o arquivo após POLLING_INTERVAL segundos (modo watchdog), como o modo
+    polling faria na próxima verificação. Não faz nada se o arquivo não existir mais.
+    """
+    delay = int(CONFIG["POLLING_INTERVAL"])
+    logging.info(f"Arquivo reagendado para daqui a {delay}s: {path}")
+    
+    def _retry():
+        if os.path.exists(path):
+            dispatch_file(path, source_cfg)
+    
+    timer = threading.Timer(delay, _retry)
+    timer.daemon = True
+    timer.start()
+
+def list_input_files(source_cfg):
+    """
+    Lista os arquivos do INPUT_DIR da fonte (e das subpastas, com RECURSIVE),
+    sem descer em REJECT_DIR, OUTPUT_DIR e PACK_DIR.
+    Retorna (arquivos a processar, total de arquivos).
+    """
+    input_dir = source_cfg["INPUT_DIR"]
+    recursive = source_cfg.get("RECURSIVE", "false").lower() in ("true", "1", "yes")
+    excluded = {os.path.abspath(source_cfg[key]) for key in ("REJECT_DIR", "OUTPUT_DIR", "PACK_DIR")}
     pdf_files = []
     total_files = 0
+    for dir_path, dir_names, file_names in os.walk(input_dir):
+        if not recursive:
+            dir_names.clear()
+        else:
+            dir_names[:] = [d for d in dir_names if os.path.abspath(os.path.join(dir_path, d)) not in excluded]
+        for file in file_names:
+            total_files += 1
+            if should_process_file(file):
+                pdf_files.append(os.path.join(dir_path, file))
+    return pdf_files, total_files
+
+def scan_directory(source_cfg=None):
+    """Escaneia diretório em modo polling, enfileirando os arquivos da fonte no escalonador"""
+    source_cfg = source_cfg or CONFIG
+    logging.info(f"Verificando pasta: {source_cfg['INPUT_DIR']}")
     try:
-        for file in os.listdir(CONFIG["INPUT_DIR"]):
-            file_path = os.path.join(CONFIG["INPUT_DIR"], file)
-            if os.path.isfile(file_path):
-                total_files += 1
-                if should_process_file(file):
-                    pdf_files.append(file_path)
+        pdf_files, total_files = list_input_files(source_cfg)
     except Exception as e:
         logging.error(f"Erro ao escanear diretório: {e}")
         return
@@ -739,17 +1481,287 @@ def scan_directory():
         logging.info(f"Verificação concluída: nenhum arquivo para processar (total: {total_files} arquivo(s) na pasta)")
     
     for pdf_path in pdf_files:
-        process_pdf(pdf_path)
+        dispatch_file(pdf_path, source_cfg)
+
+def scan_sources():
+    """Ciclo de polling: enfileira os arquivos de todas as fontes e aguarda o processamento"""
+    for source_cfg in SOURCES:
+        scan_directory(source_cfg)
+    scheduler.wait_idle()
+    
+    if len(SOURCES) > 1:
+        logging.info(f"Fontes: {scheduler.format_stats()}")
+    if get_dedup_policy() != "off":
+        logging.info(f"Duplicatas: {dedup.format_stats()}")
+    if layout_cache.ENABLED:
+        logging.info(f"Cache de layout: {layout_cache.format_stats()}")
     
     # Ajusta permissões de todos os PDFs nas pastas a cada ciclo
     fix_all_permissions()
 
+def is_extraction_error(e):
+    """Erros do extrator/pré-filtro: repetem-se enquanto a versão do extrator não mudar"""
+    return isinstance(e, (ValueError, PdfminerException))
+
+def reprocess_rejected(path):
+    """
+    Reprocessa um arquivo de REJECT_DIR diretamente de lá (sem passar por INPUT_DIR),
+    com a configuração da fonte de onde ele veio (registrada no reject_ledger).
+    path pode ser um PDF ou um XML avulso (XML_INGEST).
+    Retorna (True, destino) se recuperado, ou (False, motivo) se continua rejeitado.
+    """
+    filename = os.path.basename(path)
+    entry = reject_ledger.get(filename)
+    source_cfg = get_source(entry.get("origem")) if entry else SOURCES[0]
+    is_xml = path.lower().endswith(".xml")
+    # XML irmão rejeitado junto com o PDF
+    xml_path = None
+    if not is_xml and CONFIG.get("XML_INGEST", "false").lower() in ("true", "1", "yes"):
+        xml_path = find_sibling_xml(path)
+    try:
+        data = None if is_xml else read_input_file(path)
+        if not is_xml and CONFIG.get("PREFILTER_ENABLED", "true").lower() in ("true", "1", "yes"):
+            check_pdf_structure(data if data is not None else path)
+        digest = None
+        if get_dedup_policy() != "off":
+            digest = hashlib.sha256(data).hexdigest() if data is not None else dedup.hash_file(path)
+        source = io.BytesIO(data) if data is not None else path
+        extracted = extract_with_dedup(path, source, digest, xml_path, name_rule=source_cfg["NAME_RULE"])
+        if extracted is None:
+            # Já armazenado anteriormente: duplicata suprimida
+            os.remove(path)
+            if xml_path and os.path.exists(xml_path):
+                os.remove(xml_path)
+            reject_ledger.remove(filename)
+            return True, "duplicata suprimida"
+        new_name, fields = extracted
+        journal.log(path, "extraido", nome=new_name, sha256=digest, campos=fields)
+        
+        destino = store_processed_file(path, new_name, in_place_dir=source_cfg["INPUT_DIR"],
+                                       ext=".xml" if is_xml else ".pdf", source_cfg=source_cfg, data=data)
+        if xml_path and os.path.exists(xml_path):
+            store_sibling_xml(xml_path, new_name, destino, source_cfg)
+        if digest is not None:
+            ext = document_ext(path)
+            dedup.register(digest, new_name, destino, note_key(fields, ext), fields, ext)
+        reject_ledger.remove(filename)
+        journal.log(path, "concluido", destino=destino)
+        return True, destino or f"{new_name}{'.xml' if is_xml else '.pdf'} (FTP)"
+    except Exception as e:
+        motivo = f"{type(e).__name__}: {e}"
+        reject_ledger.record(filename, motivo, EXTRACTOR_VERSION, origem=source_cfg.get("NAME"),
+                             falha_extracao=is_extraction_error(e))
+        return False, motivo
+    finally:
+        journal.release(path)
+
+def reprocess_reject_dir(force=False, dry_run=False):
+    """
+    Reprocessa em lote os PDFs (e, com XML_INGEST, os XMLs avulsos) de REJECT_DIR
+    usando o pool de workers. Arquivos que a versão atual do extrator não conseguiu ler
+    são ignorados (a menos que force=True), pois falhariam pelo mesmo motivo; os
+    rejeitados por erros transitórios (disco, FTP, permissão) são sempre reprocessados.
+    Retorna um dicionário com a contagem de analisados, recuperados, rejeitados e ignorados.
+    """
+    reject_dir = CONFIG["REJECT_DIR"]
+    extensions = (".pdf", ".xml") if CONFIG.get("XML_INGEST", "false").lower() in ("true", "1", "yes") else (".pdf",)
+    files = sorted(os.listdir(reject_dir))
+    pdf_stems = {os.path.splitext(file)[0] for file in files if file.lower().endswith(".pdf")}
+    pending = []
+    skipped = 0
+    for file in files:
+        file_path = os.path.join(reject_dir, file)
+        if not (os.path.isfile(file_path) and file.lower().endswith(extensions)):
+            continue
+        if file.lower().endswith(".xml") and os.path.splitext(file)[0] in pdf_stems:
+            continue  # XML irmão: reprocessado junto com o seu PDF
+        entry = reject_ledger.get(file)
+        if (not force and entry and entry.get("versao_extrator") == EXTRACTOR_VERSION
+                and reject_ledger.is_extraction_failure(entry)):
+            skipped += 1
+            continue
+        pending.append(file_path)
+    
+    summary = {"analisados": len(pending) + skipped, "recuperados": 0, "rejeitados": 0, "ignorados": skipped}
+    logging.info(f"Reprocessamento de {reject_dir}: {len(pending)} arquivo(s) a reprocessar, "
+                 f"{skipped} ignorado(s) (não lidos pela versão atual do extrator {EXTRACTOR_VERSION})")
+    if dry_run:
+        for file_path in pending:
+            logging.info(f"  [dry-run] {os.path.basename(file_path)}")
+        return summary
+    
+    max_workers = int(CONFIG["MAX_WORKERS"])
+    pool = workers.get_pool(max_workers)
+    motivos = {}
+    in_flight = {}
+    
+    def _collect(done):
+        for future in done:
+            file_path = in_flight.pop(future)
+            recovered, detail = future.result()
+            if recovered:
+                summary["recuperados"] += 1
+                logging.info(f"Recuperado: {os.path.basename(file_path)} → {detail}")
+            else:
+                summary["rejeitados"] += 1
+                motivos[detail] = motivos.get(detail, 0) + 1
+    
+    for file_path in pending:
+        if len(in_flight) >= max_workers * 2:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            _collect(done)
+        in_flight[pool.submit(reprocess_rejected, file_path)] = file_path
+    done, _ = wait(list(in_flight))
+    _collect(done)
+    
+    logging.info(f"Reprocessamento concluído: {summary['recuperados']} recuperado(s), "
+                 f"{summary['rejeitados']} ainda rejeitado(s), {summary['ignorados']} ignorado(s)")
+    for motivo, count in sorted(motivos.items(), key=lambda item: item[1], reverse=True)[:10]:
+        logging.info(f"  {count:6d}x {motivo}")
+    return summary
+
 def signal_handler(signum, frame):
     """Handler para sinais de sistema (SIGTERM, SIGINT)"""
     logging.info(f"Recebido sinal {signum}, encerrando serviço...")
+    journal.close_journal()
     flush_logs()  # Garante que logs finais sejam escritos
     sys.exit(0)
 
+def lock_state_dir(wait=True):
+    """
+    Trava STATE_DIR/service.lock pelo tempo de vida do processo: apenas um processo (o serviço
+    ou o comando reprocess da CLI) reescreve e acrescenta registros ao índice de deduplicação
+    e ao registro de rejeitados. Com wait=False, retorna False se outro processo tem o lock.
+    """
+    global STATE_LOCK
+    os.makedirs(CONFIG["STATE_DIR"], exist_ok=True)
+    lock_file = open(os.path.join(CONFIG["STATE_DIR"], "service.lock"), "a")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        if not wait:
+            lock_file.close()
+            return False
+        logging.warning(f"Estado em {CONFIG['STATE_DIR']} em uso por outro processo (reprocess?), aguardando...")
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    STATE_LOCK = lock_file
+    return True
+
+def init_state():
+    """Carrega o estado persistido em STATE_DIR (índices, caches e registros)"""
+    if CONFIG["DEDUP_POLICY"].strip().lower() not in dedup.DEDUP_POLICIES:
+        logging.warning(f"DEDUP_POLICY inválida ({CONFIG['DEDUP_POLICY']}), deduplicação desativada")
+    
+    # Carrega índice de deduplicação (hash de conteúdo e chave da nota)
+    if get_dedup_policy() != "off":
+        try:
+            dedup.load_index(
+                os.path.join(CONFIG["STATE_DIR"], "dedup_index.jsonl"),
+                int(CONFIG["DEDUP_RETENTION_DAYS"]),
+            )
+        except Exception as e:
+            logging.error(f"Erro ao carregar índice de deduplicação: {e}")
+    
+    # Profiling opcional por arquivo
+    if CONFIG["PROFILE_MODE"].strip().lower() != "off":
+        try:
+            profiling.configure(
+                CONFIG["PROFILE_DIR"],
+                CONFIG["PROFILE_MODE"].strip().lower(),
+                float(CONFIG["PROFILE_SAMPLE_RATE"]),
+                int(CONFIG["PROFILE_KEEP"]),
+            )
+        except Exception as e:
+            logging.error(f"Erro ao configurar profiling: {e}")
+        # O pico do tracemalloc inclui as alocações de todas as threads: com vários
+        # workers, o valor registrado para um arquivo misturaria os demais
+        if profiling.ENABLED and profiling.MODE in profiling.MEMORY_MODES and int(CONFIG["MAX_WORKERS"]) > 1:
+            logging.warning(f"PROFILE_MODE={profiling.MODE}: MAX_WORKERS reduzido de {CONFIG['MAX_WORKERS']} para 1 "
+                            f"(o pico de memória do tracemalloc é medido no processo inteiro)")
+            CONFIG["MAX_WORKERS"] = "1"
+    
+    # Carrega cache de layouts por emitente (extração recortada)
+    if CONFIG["LAYOUT_CACHE_ENABLED"].lower() in ("true", "1", "yes"):
+        try:
+            layout_cache.load_cache(
+                os.path.join(CONFIG["STATE_DIR"], "layout_cache.json"),
+                int(CONFIG["LAYOUT_MAX_CANDIDATES"]),
+            )
+        except Exception as e:
+            logging.error(f"Erro ao carregar cache de layout: {e}")
+    
+    # Registro de rejeitados (motivo e versão do extrator, usado no reprocessamento)
+    try:
+        reject_ledger.load_ledger(os.path.join(CONFIG["STATE_DIR"], "reject_index.jsonl"))
+    except Exception as e:
+        logging.error(f"Erro ao carregar registro de rejeitados: {e}")
+    
+    # Journal de estados: conclui ou reverte o que foi interrompido na execução anterior
+    if CONFIG["JOURNAL_ENABLED"].lower() in ("true", "1", "yes"):
+        try:
+            pending = journal.open_journal(os.path.join(CONFIG["STATE_DIR"], "journal.jsonl"))
+            if pending:
+                recover_journal(pending)
+        except Exception as e:
+            logging.error(f"Erro ao abrir/recuperar journal de estados: {e}")
+
+def recover_journal(pending):
+    """
+    Conclui ou reverte os arquivos interrompidos na execução anterior, conforme o journal:
+    - armazenado/enviado: conclui (remove o original já enviado ao FTP, registra a deduplicação)
+    - armazenando: conclui se o original já está no destino; senão reverte (descarta cópia parcial)
+    - reservado/extraido: reverte (o original continua na entrada e é reenfileirado ao iniciar)
+    Membros de pacotes ZIP/TAR não são registrados: um pacote interrompido é reprocessado por
+    inteiro e os membros já armazenados só são suprimidos com DEDUP_POLICY ativa.
+    """
+    for path, entry in pending.items():
+        estado = entry["estado"]
+        destino = entry.get("destino")
+        try:
+            if estado == "armazenando":
+                if destino and os.path.exists(destino) and not os.path.exists(path):
+                    estado = "armazenado"  # Movimentação concluída antes da interrupção
+                elif destino and os.path.exists(destino):
+                    os.remove(destino)  # Cópia parcial entre sistemas de arquivos
+            
+            if estado == "enviado" and os.path.exists(path):
+                os.remove(path)
+            
+            if estado in journal.STORED_STATES:
+                if destino and os.path.exists(destino):
+                    set_file_permissions(destino)
+                if entry.get("sha256") and entry.get("nome") and get_dedup_policy() != "off":
+                    fields = entry.get("campos")
+                    ext = document_ext(path)
+                    dedup.register(entry["sha256"], entry["nome"], destino, fields and note_key(fields, ext), fields, ext)
+                journal.log(path, "concluido", destino=destino)
+                logging.info(f"Journal: processamento interrompido concluído: {path} → {destino or 'FTP'}")
+            else:
+                journal.log(path, "revertido")
+                logging.info(f"Journal: processamento interrompido revertido ({estado}): {path}")
+                if os.path.exists(path):
+                    RECOVERED_FILES.append((path, entry.get("origem")))
+        except Exception as e:
+            logging.error(f"Journal: erro ao recuperar {path} ({estado}): {type(e).__name__}: {e}")
+            journal.log(path, "revertido")
+            if os.path.exists(path):
+                RECOVERED_FILES.append((path, entry.get("origem")))
+
+def requeue_recovered():
+    """
+    Enfileira os arquivos revertidos pelo journal (no modo watchdog nenhum evento os anuncia).
+    Arquivos fora do INPUT_DIR da fonte (ex: reprocessamento da REJECT_DIR pela CLI) ficam onde estão.
+    """
+    while RECOVERED_FILES:
+        path, origem = RECOVERED_FILES.pop(0)
+        source_cfg = next((cfg for cfg in SOURCES if source_name(cfg) == origem), None)
+        if source_cfg is None:
+            source_cfg = next((cfg for cfg in SOURCES if path.startswith(cfg["INPUT_DIR"])), None)
+        if source_cfg is None or not path.startswith(source_cfg["INPUT_DIR"]) or not os.path.exists(path):
+            continue
+        logging.info(f"Journal: reenfileirando arquivo revertido: {path}")
+        dispatch_file(path, source_cfg)
+
 def main():
     """Função principal do serviço"""
     # Configura handlers de sinal
@@ -778,23 +1790,57 @@ def main():
     logging.info(f"DIR_PERMISSIONS: {CONFIG['DIR_PERMISSIONS']} (octal)")
     logging.info(f"FIX_PERMISSIONS_ON_CYCLE: {CONFIG['FIX_PERMISSIONS_ON_CYCLE']}")
     logging.info(f"RENAME_IN_PLACE: {CONFIG['RENAME_IN_PLACE']}")
+    logging.info(f"DEDUP_POLICY: {get_dedup_policy()}")
+    logging.info(f"MAX_WORKERS: {CONFIG['MAX_WORKERS']}")
+    logging.info(f"ARCHIVE_INGEST: {CONFIG['ARCHIVE_INGEST']}")
+    logging.info(f"PREFILTER_ENABLED: {CONFIG['PREFILTER_ENABLED']}")
+    logging.info(f"XML_INGEST: {CONFIG['XML_INGEST']}")
+    logging.info(f"JOURNAL_ENABLED: {CONFIG['JOURNAL_ENABLED']}")
+    logging.info(f"LAYOUT_CACHE_ENABLED: {CONFIG['LAYOUT_CACHE_ENABLED']}")
+    logging.info(f"PACK_ENABLED: {CONFIG['PACK_ENABLED']} (PACK_AFTER_DAYS: {CONFIG['PACK_AFTER_DAYS']})")
+    for source_cfg in SOURCES:
+        logging.info(f"Fonte {source_name(source_cfg)}: {source_cfg['INPUT_DIR']} → "
+                     f"{'FTP ' + source_cfg['FTP_HOST'] if source_cfg['USE_FTP'].lower() in ('true', '1', 'yes') else source_cfg['OUTPUT_DIR']} "
+                     f"(RECURSIVE: {source_cfg['RECURSIVE']}, WEIGHT: {source_cfg['WEIGHT']}, "
+                     f"NAME_RULE: {source_cfg['NAME_RULE'] or 'padrão'})")
     logging.info("=" * 60)
     
+    # Índices, caches e registros em STATE_DIR (aguarda um reprocess da CLI em andamento)
+    lock_state_dir()
+    init_state()
+    
+    # Empacotamento periódico dos arquivos antigos de cada OUTPUT_DIR (threads em baixa prioridade)
+    if CONFIG["PACK_ENABLED"].lower() in ("true", "1", "yes"):
+        for output_dir, pack_dir in pack_targets():
+            output_packer.start_background(
+                output_dir,
+                pack_dir,
+                int(CONFIG["PACK_AFTER_DAYS"]),
+                int(CONFIG["PACK_INTERVAL"]),
+                int(CONFIG["PACK_BATCH_SIZE"]),
+            )
+    
     # Ajusta permissões dos diretórios na inicialização (apenas se existirem)
     logging.info("Ajustando permissões dos diretórios...")
-    rename_in_place = CONFIG.get("RENAME_IN_PLACE", "false").lower() in ("true", "1", "yes")
-    
-    if os.path.exists(CONFIG["INPUT_DIR"]):
-        set_directory_permissions(CONFIG["INPUT_DIR"])
     
     # REJECT_DIR sempre é usado (arquivos com erro são movidos para reject)
     if os.path.exists(CONFIG["REJECT_DIR"]):
         set_directory_permissions(CONFIG["REJECT_DIR"])
     
-    # OUTPUT_DIR só é usado se não estiver em modo RENAME_IN_PLACE
-    if not rename_in_place:
-        if os.path.exists(CONFIG["OUTPUT_DIR"]):
-            set_directory_permissions(CONFIG["OUTPUT_DIR"])
+    for source_cfg in SOURCES:
+        if os.path.exists(source_cfg["INPUT_DIR"]):
+            set_directory_permissions(source_cfg["INPUT_DIR"])
+        
+        # OUTPUT_DIR só é usado se não estiver em modo RENAME_IN_PLACE
+        if source_cfg.get("RENAME_IN_PLACE", "false").lower() not in ("true", "1", "yes"):
+            if os.path.exists(source_cfg["OUTPUT_DIR"]):
+                set_directory_permissions(source_cfg["OUTPUT_DIR"])
+    
+    # Escalonador: uma fila por fonte, atendidas por peso, processadas pelo pool de workers
+    scheduler.configure(lambda path, source_cfg: process_pdf(path, source_cfg=source_cfg), int(CONFIG["MAX_WORKERS"]))
+    for source_cfg in SOURCES:
+        scheduler.add_source(source_name(source_cfg), int(source_cfg["WEIGHT"]))
+    requeue_recovered()
     
     use_polling = CONFIG["USE_POLLING"].lower() in ("true", "1", "yes")
     polling_interval = int(CONFIG["POLLING_INTERVAL"])
@@ -804,7 +1850,7 @@ def main():
         logging.info("Modo POLLING ativado")
         try:
             while True:
-                scan_directory()
+                scan_sources()
                 flush_logs()  # Garante que logs sejam escritos no arquivo
                 sleep(polling_interval)
         except KeyboardInterrupt:
@@ -816,10 +1862,12 @@ def main():
             sys.exit(1)
     else:
         # Modo watchdog (event-driven)
+        from watchdog.observers import Observer
         logging.info("Modo WATCHDOG ativado")
         observer = Observer()
-        event_handler = NFSeHandler()
-        observer.schedule(event_handler, CONFIG["INPUT_DIR"], recursive=False)
+        for source_cfg in SOURCES:
+            recursive = source_cfg["RECURSIVE"].lower() in ("true", "1", "yes")
+            observer.schedule(create_event_handler(source_cfg), source_cfg["INPUT_DIR"], recursive=recursive)
         observer.start()
         
         try:
@@ -842,19 +1890,19 @@ def main():
                 # Verifica pasta periodicamente no modo watchdog (para logs)
                 if current_time - last_verification >= verification_interval:
                     try:
-                        total_files = 0
-                        pdf_files = []
-                        for file in os.listdir(CONFIG["INPUT_DIR"]):
-                            file_path = os.path.join(CONFIG["INPUT_DIR"], file)
-                            if os.path.isfile(file_path):
-                                total_files += 1
-                                if should_process_file(file):
-                                    pdf_files.append(file_path)
+                        for source_cfg in SOURCES:
+                            pdf_files, total_files = list_input_files(source_cfg)
+                            if pdf_files:
+                                logging.info(f"Verificação periódica: {len(pdf_files)} arquivo(s) para processar (total: {total_files} arquivo(s) na pasta {source_cfg['INPUT_DIR']})")
+                            else:
+                                logging.info(f"Verificação periódica: nenhum arquivo para processar (total: {total_files} arquivo(s) na pasta {source_cfg['INPUT_DIR']})")
                         
-                        if pdf_files:
-                            logging.info(f"Verificação periódica: {len(pdf_files)} arquivo(s) para processar (total: {total_files} arquivo(s) na pasta {CONFIG['INPUT_DIR']})")
-                        else:
-                            logging.info(f"Verificação periódica: nenhum arquivo para processar (total: {total_files} arquivo(s) na pasta {CONFIG['INPUT_DIR']})")
+                        if len(SOURCES) > 1:
+                            logging.info(f"Fontes: {scheduler.format_stats()}")
+                        if get_dedup_policy() != "off":
+                            logging.info(f"Duplicatas: {dedup.format_stats()}")
+                        if layout_cache.ENABLED:
+                            logging.info(f"Cache de layout: {layout_cache.format_stats()}")
                     except Exception as e:
                         logging.warning(f"Erro ao verificar pasta periodicamente: {e}")
                     
@@ -0,0 +1,243 @@
+"""
+Empacotamento periódico dos arquivos processados.
+
+Arquivos nfse_* de OUTPUT_DIR com mais de N dias são agrupados, pela data de
+modificação, em pacotes ZIP diários sem compressão (PDFs já são comprimidos)
+e removidos de OUTPUT_DIR, reduzindo a quantidade de inodes e acelerando
+backups/rsync. Cada arquivo empacotado é registrado em um índice JSON Lines
+(nome -> pacote), que permite localizar e extrair um arquivo pelo nome lendo
+apenas o seu membro do pacote. O índice é mantido em memória (nome -> entradas)
+e atualizado lendo apenas as linhas acrescentadas ao arquivo desde a última consulta.
+
+Cada execução é incremental (no máximo batch_size arquivos) e escreve pacotes
+novos e imutáveis: um pacote só é renomeado para o nome final após fsync, e os
+originais só são removidos depois de registrados no índice.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+import zlib
+
+PACK_PATTERN = "nfse_{dia}*.zip"
+INDEX_FILENAME = "index.jsonl"
+YIELD_EVERY = 100  # Arquivos empacotados entre pausas, para ceder I/O ao processamento
+YIELD_SECONDS = 0.05
+
+_INDEX = {}  # PACK_DIR (absoluto) -> [bytes já lidos de index.jsonl, {nome: [(pacote, tamanho, mtime)]}]
+_INDEX_LOCK = threading.Lock()
+
+def _crc32(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def _candidates(output_dir, older_than_days, batch_size):
+    """Arquivos nfse_* mais antigos que older_than_days, agrupados por dia (AAAA-MM-DD)."""
+    limit = time.time() - older_than_days * 86400
+    by_day = {}
+    total = 0
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if not (name.lower().startswith("nfse_") and name.lower().endswith((".pdf", ".xml"))):
+                continue
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            if mtime >= limit:
+                continue
+            day = time.strftime("%Y-%m-%d", time.localtime(mtime))
+            by_day.setdefault(day, []).append((entry.path, mtime))
+            total += 1
+            if total >= batch_size:
+                break
+    return by_day
+
+def _packed_members(pack_dir, day):
+    """Membros já empacotados no dia: nome -> (tamanho, crc, pacote)."""
+    members = {}
+    for pack_path in sorted(glob.glob(os.path.join(pack_dir, PACK_PATTERN.format(dia=day)))):
+        try:
+            with zipfile.ZipFile(pack_path) as zf:
+                for info in zf.infolist():
+                    members[info.filename] = (info.file_size, info.CRC, os.path.basename(pack_path))
+        except (OSError, zipfile.BadZipFile) as e:
+            logging.warning(f"Pacote ilegível ignorado: {pack_path}: {e}")
+    return members
+
+def _new_pack_path(pack_dir, day):
+    pack_path = os.path.join(pack_dir, f"nfse_{day}.zip")
+    seq = 2
+    while os.path.exists(pack_path):
+        pack_path = os.path.join(pack_dir, f"nfse_{day}_{seq}.zip")
+        seq += 1
+    return pack_path
+
+def _append_index(index_file, entries):
+    with open(index_file, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _remove_originals(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"Arquivo empacotado, mas erro ao remover de OUTPUT_DIR: {path}: {e}")
+
+def _pack_day(pack_dir, index_file, day, files):
+    """Empacota os arquivos de um dia em um pacote novo; retorna (arquivos, bytes)."""
+    already = _packed_members(pack_dir, day)
+    to_pack = []
+    recovered = []
+    for path, mtime in files:
+        name = os.path.basename(path)
+        packed = already.get(name)
+        if packed and packed[0] == os.path.getsize(path) and packed[1] == _crc32(path):
+            # Empacotado em execução anterior interrompida antes do índice/remoção
+            recovered.append((path, {"nome": name, "pacote": packed[2], "tamanho": packed[0],
+                                     "mtime": mtime, "ts": time.time()}))
+        else:
+            to_pack.append((path, mtime))
+    if recovered:
+        _append_index(index_file, [entry for _, entry in recovered])
+        _remove_originals(path for path, _ in recovered)
+    if not to_pack:
+        return 0, 0
+
+    pack_path = _new_pack_path(pack_dir, day)
+    tmp_path = pack_path + ".tmp"
+    index_entries = []
+    total_bytes = 0
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for count, (path, mtime) in enumerate(to_pack, 1):
+            name = os.path.basename(path)
+            info = zipfile.ZipInfo(name, date_time=time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as src, zf.open(info, "w") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            size = zf.getinfo(name).file_size
+            total_bytes += size
+            index_entries.append({"nome": name, "pacote": os.path.basename(pack_path),
+                                  "tamanho": size, "mtime": mtime, "ts": time.time()})
+            if count % YIELD_EVERY == 0:
+                time.sleep(YIELD_SECONDS)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pack_path)
+
+    _append_index(index_file, index_entries)
+    _remove_originals(path for path, _ in to_pack)
+    logging.info(f"Pacote criado: {pack_path} ({len(to_pack)} arquivo(s), {total_bytes / (1024 * 1024):.1f} MB)")
+    return len(to_pack), total_bytes
+
+def pack_once(output_dir, pack_dir, older_than_days, batch_size=5000):
+    """
+    Executa uma rodada de empacotamento (no máximo batch_size arquivos).
+    Retorna {"arquivos", "pacotes", "bytes"} da rodada.
+    """
+    os.makedirs(pack_dir, exist_ok=True)
+    index_file = os.path.join(pack_dir, INDEX_FILENAME)
+    summary = {"arquivos": 0, "pacotes": 0, "bytes": 0}
+    # Uma rodada por vez, mesmo entre processos (serviço e comando "pack" da CLI)
+    with open(os.path.join(pack_dir, ".lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logging.info(f"Empacotamento já em execução em {pack_dir}, rodada ignorada")
+            return summary
+        # Pacotes incompletos de rodadas interrompidas
+        for tmp_path in glob.glob(os.path.join(pack_dir, "*.zip.tmp")):
+            os.remove(tmp_path)
+        for day, files in sorted(_candidates(output_dir, older_than_days, batch_size).items()):
+            try:
+                packed, size = _pack_day(pack_dir, index_file, day, files)
+            except Exception as e:
+                logging.error(f"Erro ao empacotar arquivos de {day}: {type(e).__name__}: {e}")
+                continue
+            if packed:
+                summary["arquivos"] += packed
+                summary["pacotes"] += 1
+                summary["bytes"] += size
+    return summary
+
+def _lower_thread_priority():
+    """Reduz a prioridade de CPU da thread atual (Linux: nice por thread)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+def start_background(output_dir, pack_dir, older_than_days, interval, batch_size=5000):
+    """Inicia a thread de empacotamento periódico em baixa prioridade."""
+    def _loop():
+        _lower_thread_priority()
+        while True:
+            try:
+                summary = pack_once(output_dir, pack_dir, older_than_days, batch_size)
+                if summary["arquivos"]:
+                    logging.info(f"Empacotamento: {summary['arquivos']} arquivo(s) em {summary['pacotes']} pacote(s)")
+            except Exception as e:
+                logging.error(f"Erro no empacotamento periódico: {type(e).__name__}: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=_loop, name="nfse-packer", daemon=True)
+    thread.start()
+    logging.info(f"Empacotamento periódico ativo: arquivos com mais de {older_than_days} dia(s) → {pack_dir}")
+    return thread
+
+def _load_index(pack_dir):
+    """Índice nome -> entradas do PACK_DIR, lendo do arquivo apenas as linhas novas."""
+    index_file = os.path.join(pack_dir, INDEX_FILENAME)
+    with _INDEX_LOCK:
+        state = _INDEX.setdefault(os.path.abspath(pack_dir), [0, {}])
+        try:
+            size = os.path.getsize(index_file)
+        except OSError:
+            return state[1]
+        if size < state[0]:
+            state[0], state[1] = 0, {}  # Índice substituído: relê do início
+        if size > state[0]:
+            with open(index_file, "rb") as f:
+                f.seek(state[0])
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Linha ainda em gravação: lida na próxima consulta
+                    state[0] += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    state[1].setdefault(entry["nome"], []).append((entry["pacote"], entry["tamanho"], entry["mtime"]))
+        return state[1]
+
+def is_packed(pack_dir, name):
+    """Indica se já existe um arquivo empacotado com esse nome (o nome não deve ser reutilizado)."""
+    return name in _load_index(pack_dir)
+
+def lookup(pack_dir, name):
+    """Todas as ocorrências do arquivo empacotado no índice, da mais antiga para a mais recente."""
+    return [{"nome": name, "pacote": pacote, "tamanho": tamanho, "mtime": mtime}
+            for pacote, tamanho, mtime in _load_index(pack_dir).get(name, [])]
+
+def extract(pack_dir, entry, dest_dir):
+    """Extrai um único arquivo do pacote indicado no índice; retorna o caminho extraído."""
+    os.makedirs(dest_dir, exist_ok=True)
+    dest_path = os.path.join(dest_dir, entry["nome"])
+    with zipfile.ZipFile(os.path.join(pack_dir, entry["pacote"])) as zf:
+        with zf.open(entry["nome"]) as src, open(dest_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    return dest_path
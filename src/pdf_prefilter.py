@@ -0,0 +1,59 @@
+"""
+Pré-filtro estrutural de PDFs.
+
+Verificação em nível de bytes, executada antes do pdfplumber, para rejeitar
+rapidamente PDFs corrompidos (família "No /Root object") e PDFs digitalizados
+sem camada de texto.
+"""
+import mmap
+import os
+
+HEADER_WINDOW = 1024  # %PDF- deve aparecer no início do arquivo
+TAIL_WINDOW = 2048  # %%EOF/startxref costumam ficar no final do arquivo
+
+class PdfEstruturaInvalida(ValueError):
+    """PDF rejeitado pelo pré-filtro estrutural (motivo na mensagem)."""
+    pass
+
+def _check_buffer(buf):
+    size = len(buf)
+    if size == 0:
+        raise PdfEstruturaInvalida("arquivo vazio (0 bytes)")
+
+    if buf.find(b"%PDF-", 0, HEADER_WINDOW) == -1:
+        raise PdfEstruturaInvalida(f"cabeçalho %PDF- ausente nos primeiros {HEADER_WINDOW} bytes (não é um PDF)")
+
+    # PDFs assinados ou salvos incrementalmente podem ter mais de TAIL_WINDOW bytes
+    # após o %%EOF: fora da janela final, os marcadores são procurados no arquivo inteiro
+    tail_start = max(0, size - TAIL_WINDOW)
+    if buf.find(b"%%EOF", tail_start) == -1 and buf.find(b"startxref", tail_start) == -1 \
+            and buf.rfind(b"%%EOF") == -1 and buf.rfind(b"startxref") == -1:
+        raise PdfEstruturaInvalida("marcadores finais %%EOF/startxref ausentes (arquivo truncado)")
+
+    # Trailer clássico ("trailer") ou cross-reference stream (PDF 1.5+, "/XRef")
+    if buf.find(b"trailer") == -1 and buf.find(b"/XRef") == -1:
+        raise PdfEstruturaInvalida("trailer ausente (tabela de referências cruzadas não encontrada)")
+
+    if buf.find(b"/Root") == -1:
+        raise PdfEstruturaInvalida("trailer sem /Root (catálogo do documento ausente)")
+
+    # Sem fonte declarada não há como existir texto. Operadores de texto (BT/Tj) ficam
+    # em streams comprimidos e não são verificáveis em nível de bytes. Com object
+    # streams (/ObjStm) os dicionários de fonte podem estar comprimidos: inconclusivo.
+    if buf.find(b"/Font") == -1 and buf.find(b"/ObjStm") == -1:
+        raise PdfEstruturaInvalida("nenhuma fonte declarada: PDF sem camada de texto (digitalizado/somente imagem)")
+
+def check_pdf_structure(source):
+    """
+    Valida a estrutura mínima do PDF sem fazer parsing.
+    source pode ser um caminho ou o conteúdo em bytes.
+    Lança PdfEstruturaInvalida com o motivo preciso da rejeição.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        _check_buffer(source)
+        return
+
+    if os.path.getsize(source) == 0:
+        raise PdfEstruturaInvalida("arquivo vazio (0 bytes)")
+    with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        _check_buffer(buf)
@@ -0,0 +1,205 @@
+"""
+Profiling opcional por arquivo (cProfile e/ou tracemalloc).
+
+Mantém, em um diretório rotativo, os perfis dos N arquivos mais lentos e dos N
+que mais consumiram memória, com o tempo de cada etapa do processamento, para
+transformar entradas patológicas em casos de benchmark.
+"""
+import io
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# cProfile, tracemalloc e pstats são importados apenas quando usados (profiling ativo ou resumo)
+
+PROFILE_MODES = ("off", "cprofile", "tracemalloc", "both")
+MEMORY_MODES = ("tracemalloc", "both")  # tracemalloc mede o processo inteiro: exige um único worker
+INDEX_FILENAME = "index.json"
+
+ENABLED = False
+MODE = "off"
+SAMPLE_RATE = 1.0
+KEEP = 10
+
+_profile_dir = None
+_entries = []
+_local = threading.local()
+_index_lock = threading.Lock()
+# cProfile e tracemalloc são globais ao processo: apenas um arquivo é perfilado por vez
+_profiler_lock = threading.Lock()
+
+def configure(profile_dir, mode, sample_rate=1.0, keep=10):
+    """Ativa o profiling e carrega o índice dos perfis já guardados."""
+    global ENABLED, MODE, SAMPLE_RATE, KEEP, _profile_dir, _entries
+    MODE = mode if mode in PROFILE_MODES else "off"
+    ENABLED = MODE != "off"
+    SAMPLE_RATE = sample_rate
+    KEEP = max(1, keep)
+    _profile_dir = profile_dir
+    if not ENABLED:
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    _entries = load_index(profile_dir)
+    logging.info(f"Profiling ativo: modo={MODE}, amostragem={SAMPLE_RATE}, mantidos={KEEP} em {profile_dir}")
+
+def load_index(profile_dir):
+    """Lê o índice de perfis guardados."""
+    index_path = os.path.join(profile_dir, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return []
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def mark(stage):
+    """Registra o tempo decorrido desde a marca anterior como a duração da etapa informada."""
+    record = getattr(_local, "record", None)
+    if record is None:
+        return
+    now = time.perf_counter()
+    record["etapas"][stage] = record["etapas"].get(stage, 0.0) + (now - _local.last_mark)
+    _local.last_mark = now
+
+@contextmanager
+def profile_file(path):
+    """
+    Perfila o processamento de um arquivo (no-op se desativado, fora da amostragem
+    ou se já houver um perfil ativo nesta thread, como nas chamadas de retry).
+    """
+    if not ENABLED or getattr(_local, "record", None) is not None or random.random() >= SAMPLE_RATE:
+        yield
+        return
+
+    import cProfile
+    import tracemalloc
+    
+    record = {"arquivo": os.path.basename(path), "inicio": time.time(), "etapas": {}}
+    _local.record = record
+    start = _local.last_mark = time.perf_counter()
+    profiler = None
+    tracing = False
+    got_lock = _profiler_lock.acquire(blocking=False)
+    if got_lock:
+        if MODE in ("cprofile", "both"):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if MODE in ("tracemalloc", "both") and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracing = True
+    try:
+        yield
+    finally:
+        snapshot = None
+        if profiler:
+            profiler.disable()
+        if tracing:
+            snapshot = tracemalloc.take_snapshot()
+            record["pico_memoria"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if got_lock:
+            _profiler_lock.release()
+        record["duracao"] = time.perf_counter() - start
+        _local.record = None
+        try:
+            _store(record, profiler, snapshot)
+        except Exception as e:
+            logging.warning(f"Erro ao guardar perfil de {path}: {e}")
+
+def _kept(entries):
+    """Entradas mantidas: N mais lentas e N com maior pico de memória."""
+    slowest = sorted(entries, key=lambda e: e["duracao"], reverse=True)[:KEEP]
+    hungriest = sorted(
+        (e for e in entries if e.get("pico_memoria") is not None),
+        key=lambda e: e["pico_memoria"], reverse=True,
+    )[:KEEP]
+    kept_ids = {e["id"] for e in slowest} | {e["id"] for e in hungriest}
+    return [e for e in entries if e["id"] in kept_ids]
+
+def _store(record, profiler, snapshot):
+    global _entries
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", record["arquivo"])
+    record["id"] = f"{int(record['inicio'] * 1000)}_{threading.get_ident()}_{safe_name}"
+
+    with _index_lock:
+        kept = _kept(_entries + [record])
+        if record not in kept:
+            return  # Não está entre os mais lentos/pesados: descarta sem gravar nada
+
+        if profiler:
+            record["cprofile"] = record["id"] + ".prof"
+            profiler.dump_stats(os.path.join(_profile_dir, record["cprofile"]))
+        if snapshot:
+            record["tracemalloc"] = record["id"] + ".mem.txt"
+            with open(os.path.join(_profile_dir, record["tracemalloc"]), "w", encoding="utf-8") as f:
+                for stat in snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+
+        # Remove os arquivos dos perfis que saíram do ranking
+        kept_ids = {e["id"] for e in kept}
+        for entry in _entries:
+            if entry["id"] not in kept_ids:
+                for key in ("cprofile", "tracemalloc"):
+                    if entry.get(key):
+                        try:
+                            os.remove(os.path.join(_profile_dir, entry[key]))
+                        except OSError:
+                            pass
+        _entries = kept
+
+        index_path = os.path.join(_profile_dir, INDEX_FILENAME)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(_entries, f, indent=2)
+        os.replace(index_path + ".tmp", index_path)
+
+def print_summary(profile_dir, top=10, functions=15):
+    """Imprime os arquivos mais lentos e mais pesados e as funções mais custosas de cada perfil."""
+    import pstats
+    
+    entries = load_index(profile_dir)
+    if not entries:
+        print(f"Nenhum perfil encontrado em {profile_dir}")
+        return
+
+    def _fmt_mem(value):
+        return f"{value / (1024 * 1024):.1f} MB" if value is not None else "-"
+
+    def _fmt_stages(entry):
+        return ", ".join(f"{name}={secs:.2f}s" for name, secs in entry["etapas"].items())
+
+    slowest = sorted(entries, key=lambda e: e["duracao"], reverse=True)[:top]
+    print(f"== Arquivos mais lentos ({profile_dir}) ==")
+    for entry in slowest:
+        inicio = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["inicio"]))
+        print(f"{entry['duracao']:8.2f}s  {_fmt_mem(entry.get('pico_memoria')):>9}  {inicio}  {entry['arquivo']}")
+        print(f"           etapas: {_fmt_stages(entry)}")
+
+    hungriest = sorted(
+        (e for e in entries if e.get("pico_memoria") is not None),
+        key=lambda e: e["pico_memoria"], reverse=True,
+    )[:top]
+    if hungriest:
+        print()
+        print("== Arquivos com maior pico de memória ==")
+        for entry in hungriest:
+            print(f"{_fmt_mem(entry['pico_memoria']):>9}  {entry['duracao']:8.2f}s  {entry['arquivo']}")
+            if entry.get("tracemalloc"):
+                print(f"           alocações: {os.path.join(profile_dir, entry['tracemalloc'])}")
+
+    for entry in slowest:
+        if not entry.get("cprofile"):
+            continue
+        prof_path = os.path.join(profile_dir, entry["cprofile"])
+        if not os.path.exists(prof_path):
+            continue
+        print()
+        print(f"== {entry['arquivo']} ({entry['duracao']:.2f}s) - {prof_path} ==")
+        output = io.StringIO()
+        pstats.Stats(prof_path, stream=output).sort_stats("cumulative").print_stats(functions)
+        print(output.getvalue().strip())
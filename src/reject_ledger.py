@@ -0,0 +1,85 @@
+"""
+Registro dos arquivos rejeitados.
+
+Para cada arquivo em REJECT_DIR guarda o motivo da rejeição e a versão do
+extrator (EXTRACTOR_VERSION) que o rejeitou, em um arquivo JSON Lines onde a
+última linha de cada arquivo prevalece. Permite reprocessar apenas os rejeitados
+cuja versão do extrator mudou desde a rejeição; rejeições por outros motivos
+(erros de disco, FTP, permissão) são sempre reprocessadas.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+_LOCK = threading.Lock()
+_ENTRIES = {}  # nome do arquivo em REJECT_DIR -> {"motivo", "versao_extrator", "falha_extracao", "ts"}
+# Tipos de erro das falhas de extração, para entradas gravadas sem "falha_extracao"
+EXTRACTION_ERROR_TYPES = ("ValueError", "PdfminerException", "PdfEstruturaInvalida")
+_LEDGER_FILE = None
+
+def load_ledger(ledger_file):
+    """Carrega o registro e reescreve o arquivo compactado (uma linha por arquivo)."""
+    global _LEDGER_FILE
+    os.makedirs(os.path.dirname(ledger_file), exist_ok=True)
+    with _LOCK:
+        _LEDGER_FILE = ledger_file
+        _ENTRIES.clear()
+        if os.path.exists(ledger_file):
+            with open(ledger_file, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Linha truncada por encerramento abrupto
+                    if entry.get("removido"):
+                        _ENTRIES.pop(entry["arquivo"], None)
+                    else:
+                        _ENTRIES[entry["arquivo"]] = entry
+
+        tmp_file = ledger_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for entry in _ENTRIES.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, ledger_file)
+
+def _append(entry):
+    if not _LEDGER_FILE:
+        return
+    try:
+        with open(_LEDGER_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logging.warning(f"Erro ao persistir registro de rejeitados: {e}")
+
+def record(filename, motivo, versao_extrator, origem=None, falha_extracao=True):
+    """
+    Registra (ou atualiza) a rejeição de um arquivo em REJECT_DIR.
+    origem é o nome da fonte de entrada (SOURCES) de onde o arquivo veio.
+    falha_extracao indica se o extrator reprovou o arquivo (False: erro transitório,
+    como disco ou FTP, que não depende da versão do extrator).
+    """
+    entry = {"arquivo": filename, "motivo": motivo, "versao_extrator": versao_extrator,
+             "falha_extracao": falha_extracao, "ts": time.time()}
+    if origem:
+        entry["origem"] = origem
+    with _LOCK:
+        _ENTRIES[filename] = entry
+        _append(entry)
+
+def remove(filename):
+    """Remove o arquivo do registro (recuperado pelo reprocessamento)."""
+    with _LOCK:
+        if _ENTRIES.pop(filename, None) is not None:
+            _append({"arquivo": filename, "removido": True, "ts": time.time()})
+
+def get(filename):
+    with _LOCK:
+        return _ENTRIES.get(filename)
+
+def is_extraction_failure(entry):
+    """Indica se a rejeição registrada foi uma falha de extração (e não um erro transitório)."""
+    if "falha_extracao" in entry:
+        return entry["falha_extracao"]
+    return entry.get("motivo", "").split(":", 1)[0] in EXTRACTION_ERROR_TYPES
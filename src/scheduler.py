@@ -0,0 +1,174 @@
+"""
+Escalonador justo entre as fontes de entrada (SOURCES).
+
+Cada fonte tem a sua fila. Um despachante entrega os arquivos ao pool de
+workers compartilhado, mantendo no máximo max_in_flight arquivos no pool, e
+escolhe a próxima fonte por round-robin ponderado suave: a cada escolha, cada
+fonte com arquivos na fila soma o seu peso ao próprio crédito; a de maior
+crédito é atendida e perde a soma dos pesos. Uma fonte com muitos arquivos não
+impede as demais de serem atendidas, e cada uma recebe uma fração do pool
+proporcional ao seu peso enquanto houver disputa.
+
+Pacotes ZIP/TAR são lidos por uma thread leitora da fonte (um pacote por vez);
+os seus membros entram na fila da mesma fonte, com o mesmo peso (submit_call).
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from . import workers
+
+_COND = threading.Condition()
+_QUEUES = {}  # nome da fonte -> deque[(caminho ou None, função ou None, argumentos, Future ou None)]
+_WEIGHTS = {}
+_CREDITS = {}
+_QUEUED = set()  # Caminhos na fila ou em processamento (arquivos e pacotes)
+_STATS = {}  # nome da fonte -> itens despachados
+_ARCHIVES = {}  # nome da fonte -> deque[(caminho, configuração da fonte)] de pacotes aguardando leitura
+_handler = None
+_max_in_flight = 1
+_in_flight = 0
+_reading = 0  # Pacotes em leitura
+_thread = None
+
+def configure(handler, max_in_flight):
+    """Define a função que processa cada arquivo, handler(caminho, configuração da fonte), e inicia o despachante."""
+    global _handler, _max_in_flight
+    with _COND:
+        _handler = handler
+        _max_in_flight = max(1, max_in_flight)
+        _start()
+
+def _start():
+    """Inicia o despachante, se ainda não iniciado (chamado com _COND adquirido)."""
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_dispatch, name="nfse-scheduler", daemon=True)
+        _thread.start()
+
+def add_source(name, weight=1):
+    """Registra uma fonte com o seu peso (mínimo 1)."""
+    with _COND:
+        _QUEUES.setdefault(name, deque())
+        _WEIGHTS[name] = max(1, weight)
+        _CREDITS.setdefault(name, 0)
+        _STATS.setdefault(name, 0)
+
+def _enqueue(name, item):
+    """Anexa o item à fila da fonte (registrada com peso 1 se desconhecida). Chamado com _COND adquirido."""
+    if name not in _QUEUES:
+        _QUEUES[name] = deque()
+        _WEIGHTS[name] = 1
+        _CREDITS[name] = 0
+        _STATS[name] = 0
+    _QUEUES[name].append(item)
+    _COND.notify_all()
+
+def submit(name, path, source_cfg):
+    """Enfileira o arquivo na fila da fonte; retorna False se ele já está na fila ou em processamento."""
+    with _COND:
+        if path in _QUEUED:
+            return False
+        _QUEUED.add(path)
+        _enqueue(name, (path, None, (path, source_cfg), None))
+        return True
+
+def submit_call(name, fn, *args):
+    """
+    Enfileira fn(*args) na fila da fonte (ex: membro de um pacote), disputando os
+    workers com os demais arquivos pelo peso da fonte. Retorna um Future com o resultado.
+    """
+    future = Future()
+    with _COND:
+        _start()
+        _enqueue(name, (None, fn, args, future))
+    return future
+
+def submit_archive(name, path, source_cfg):
+    """
+    Enfileira o pacote para a thread leitora da fonte, que processa um pacote por vez
+    com o handler (fora do pool: os membros são enviados por submit_call).
+    Retorna False se o pacote já está na fila ou em leitura.
+    """
+    with _COND:
+        if path in _QUEUED:
+            return False
+        _QUEUED.add(path)
+        if name not in _ARCHIVES:
+            _ARCHIVES[name] = deque()
+            threading.Thread(target=_read_archives, args=(name,), name=f"nfse-pacotes-{name}", daemon=True).start()
+        _ARCHIVES[name].append((path, source_cfg))
+        _COND.notify_all()
+        return True
+
+def _read_archives(name):
+    global _reading
+    queue = _ARCHIVES[name]
+    while True:
+        with _COND:
+            while not queue:
+                _COND.wait()
+            path, source_cfg = queue.popleft()
+            _reading += 1
+        try:
+            _handler(path, source_cfg)
+        except Exception as e:
+            logging.error(f"Erro não tratado ao processar pacote {path}: {type(e).__name__}: {e}")
+        finally:
+            with _COND:
+                _reading -= 1
+                _QUEUED.discard(path)
+                _COND.notify_all()
+
+def _pick():
+    """Escolhe a próxima fonte (round-robin ponderado suave). Chamado com _COND adquirido."""
+    ready = [name for name, queue in _QUEUES.items() if queue]
+    total = sum(_WEIGHTS[name] for name in ready)
+    for name in ready:
+        _CREDITS[name] += _WEIGHTS[name]
+    chosen = max(ready, key=lambda name: _CREDITS[name])
+    _CREDITS[chosen] -= total
+    return chosen
+
+def _dispatch():
+    global _in_flight
+    while True:
+        with _COND:
+            while _in_flight >= _max_in_flight or not any(_QUEUES.values()):
+                _COND.wait()
+            name = _pick()
+            item = _QUEUES[name].popleft()
+            _in_flight += 1
+            _STATS[name] += 1
+        workers.get_pool(_max_in_flight).submit(_run, *item)
+
+def _run(path, fn, args, future):
+    global _in_flight
+    try:
+        result = (fn or _handler)(*args)
+        if future is not None:
+            future.set_result(result)
+    except Exception as e:
+        if future is not None:
+            future.set_exception(e)
+        else:
+            logging.error(f"Erro não tratado ao processar {path}: {type(e).__name__}: {e}")
+    finally:
+        with _COND:
+            _in_flight -= 1
+            if path is not None:
+                _QUEUED.discard(path)
+            _COND.notify_all()
+
+def wait_idle():
+    """Aguarda todas as filas esvaziarem e os arquivos e pacotes em processamento terminarem."""
+    with _COND:
+        while _in_flight or _reading or any(_QUEUES.values()) or any(_ARCHIVES.values()):
+            _COND.wait()
+
+def format_stats():
+    """Resumo por fonte (na fila / despachados, incluindo membros de pacotes) para log."""
+    with _COND:
+        return ", ".join(f"{name}: {len(queue)} na fila, {_STATS[name]} despachado(s)"
+                         for name, queue in _QUEUES.items())
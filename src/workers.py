@@ -0,0 +1,24 @@
+"""
+Pool de workers compartilhado pelo serviço para processamento paralelo.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_POOL = None
+_LOCK = threading.Lock()
+
+def get_pool(max_workers):
+    """Retorna o pool compartilhado, criando-o na primeira chamada."""
+    global _POOL
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="nfse-worker")
+        return _POOL
+
+def shutdown_pool(wait=True):
+    """Encerra o pool compartilhado (se criado)."""
+    global _POOL
+    with _LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=wait)
+            _POOL = None